@@ -0,0 +1,175 @@
+"""Query count and latency budgets of the posts views.
+
+The data volume is scaled by YATUBE_PERF_SCALE: 1 seeds 100k posts,
+10k users and 50 follows per user, the default keeps the suite fast
+enough for every run. Time budgets are multiplied by
+YATUBE_PERF_TIME_FACTOR for slow machines. The measurements are
+written as JSON to YATUBE_PERF_REPORT (perf_report.json by default).
+"""
+import json
+import os
+import random
+import time
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from faker import Faker
+
+from posts import timeline
+from posts.models import Comment, Follow, Group, Post, UserStats
+
+SCALE = float(os.environ.get('YATUBE_PERF_SCALE', '0.01'))
+TIME_FACTOR = float(os.environ.get('YATUBE_PERF_TIME_FACTOR', '1'))
+REPORT_PATH = os.environ.get('YATUBE_PERF_REPORT', 'perf_report.json')
+
+POSTS = max(int(100_000 * SCALE), 50)
+USERS = max(int(10_000 * SCALE), 20)
+FOLLOWS_PER_USER = min(50, USERS - 1)
+GROUPS = 10
+COMMENTS = 200
+
+# view: (max queries on a cold cache, time budget in ms)
+BUDGETS = {
+    'index': (3, 300),
+    'index_warm': (0, 50),
+    'group_posts': (3, 300),
+    'profile': (3, 300),
+    'post_detail': (3, 300),
+    'follow_index': (6, 400),
+}
+
+report = []
+
+
+@pytest.fixture(scope='module')
+def dataset(django_db_setup, django_db_blocker):
+    fake = Faker('ru_RU')
+    fake.seed_instance(1)
+    rnd = random.Random(1)
+    with django_db_blocker.unblock():
+        from django.contrib.auth import get_user_model
+        User = get_user_model()
+        User.objects.bulk_create(
+            (User(username=f'perf_{i}') for i in range(USERS)))
+        users = list(User.objects.filter(
+            username__startswith='perf_').values_list('id', flat=True))
+        groups = [
+            Group.objects.create(title=fake.word(), slug=f'perf-{i}',
+                                 description=fake.sentence())
+            for i in range(GROUPS)
+        ]
+        Post.objects.bulk_create(
+            (Post(text=fake.text(200), author_id=rnd.choice(users),
+                  group=rnd.choice(groups + [None]))
+             for _ in range(POSTS)))
+        Follow.objects.bulk_create(
+            (Follow(user_id=user_id, author_id=author_id)
+             for user_id in users
+             for author_id in rnd.sample(users, FOLLOWS_PER_USER)
+             if author_id != user_id), ignore_conflicts=True)
+        for user_id in users:
+            UserStats.objects.update_or_create(
+                user_id=user_id, defaults={
+                    'post_count': Post.objects.filter(
+                        author_id=user_id).count(),
+                    'follower_count': Follow.objects.filter(
+                        author_id=user_id).count(),
+                    'following_count': Follow.objects.filter(
+                        user_id=user_id).count()})
+
+        reader = User.objects.get(pk=users[0])
+        for author_id in Follow.objects.filter(
+                user=reader).values_list('author_id', flat=True):
+            timeline.backfill(reader.pk, author_id)
+
+        post = Post.objects.filter(author_id__in=users).last()
+        Comment.objects.bulk_create(
+            (Comment(post=post, author_id=rnd.choice(users),
+                     text=fake.sentence())
+             for _ in range(COMMENTS)))
+        Post.objects.filter(pk=post.pk).update(comment_count=COMMENTS)
+
+        yield {
+            'reader': reader,
+            'group': groups[0],
+            'author': post.author,
+            'post': post,
+        }
+
+        Post.objects.filter(author_id__in=users).delete()
+        Group.objects.filter(slug__startswith='perf-').delete()
+        User.objects.filter(pk__in=users).delete()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def write_report():
+    yield
+    with open(REPORT_PATH, 'w') as report_file:
+        json.dump({
+            'scale': SCALE,
+            'posts': POSTS,
+            'users': USERS,
+            'results': report,
+        }, report_file, ensure_ascii=False, indent=2)
+
+
+def measure(client, name, url):
+    max_queries, budget_ms = BUDGETS[name]
+    budget_ms *= TIME_FACTOR
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = client.get(url)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    result = {
+        'view': name,
+        'url': url,
+        'status': response.status_code,
+        'queries': len(queries),
+        'max_queries': max_queries,
+        'ms': round(elapsed_ms, 2),
+        'budget_ms': budget_ms,
+    }
+    result['passed'] = (response.status_code == 200
+                        and result['queries'] <= max_queries
+                        and elapsed_ms <= budget_ms)
+    report.append(result)
+
+    assert response.status_code == 200, f'Страница `{url}` недоступна'
+    assert len(queries) <= max_queries, (
+        f'Страница `{url}` делает {len(queries)} запросов к БД, '
+        f'допустимо не больше {max_queries}:\n'
+        + '\n'.join(query['sql'] for query in queries.captured_queries)
+    )
+    assert elapsed_ms <= budget_ms, (
+        f'Страница `{url}` отвечает за {elapsed_ms:.0f} мс, '
+        f'допустимо не больше {budget_ms:.0f} мс'
+    )
+    return response
+
+
+@pytest.mark.django_db
+class TestPerformance:
+
+    def test_index(self, client, dataset):
+        cache.clear()
+        measure(client, 'index', '/')
+        measure(client, 'index_warm', '/')
+
+    def test_group_posts(self, client, dataset):
+        cache.clear()
+        measure(client, 'group_posts', f'/group/{dataset["group"].slug}/')
+
+    def test_profile(self, client, dataset):
+        cache.clear()
+        measure(client, 'profile', f'/profile/{dataset["author"].username}/')
+
+    def test_post_detail(self, client, dataset):
+        cache.clear()
+        measure(client, 'post_detail', f'/posts/{dataset["post"].id}/')
+
+    def test_follow_index(self, client, dataset):
+        cache.clear()
+        client.force_login(dataset['reader'])
+        measure(client, 'follow_index', '/follow/')
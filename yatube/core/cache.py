@@ -0,0 +1,267 @@
+"""Two-tier cache: a small per-process LRU in front of a shared cache.
+
+Reads are served from process memory when possible and fall back to
+the shared cache, which all the workers see. Every write appends its
+keys to a change log kept in the shared cache, adds too: a key missing
+from the shared cache may have been evicted there and still be held by
+other processes. The other processes read the new part of the log at
+most once every SYNC_INTERVAL seconds and drop just the logged keys
+from their local entries, so a write reaches every worker within
+SYNC_INTERVAL.
+
+The whole local tiers are dropped only on clear() and when the log is
+lost: evicted from the shared cache or too far behind to read.
+
+Set OPTIONS['SHARED'] to the alias of the shared cache.
+"""
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+GENERATION_KEY = 'two_tier:generation'
+SEQUENCE_KEY = 'two_tier:sequence'
+CHANGE_KEY = 'two_tier:change:{}'
+# a process that hasn't synced for longer drops its whole local tier
+CHANGE_LOG_TIMEOUT = 60 * 10
+MAX_CHANGES_PER_SYNC = 1000
+MAX_LOG_ATTEMPTS = 10
+
+# local tiers by LOCATION, shared by the threads of the process
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class LocalTier:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        # the last log entry read, None before the first sync
+        self.sequence = None
+        # log entries written by this process, not to be dropped
+        self.own = set()
+        self.next_sync = 0
+
+
+class TwoTierCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options['SHARED']
+        self._sync_interval = options.get('SYNC_INTERVAL', 1)
+        # entries live locally no longer than this, whatever
+        # the timeout in the shared cache
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 60)
+        with _tiers_lock:
+            self._tier = _tiers.setdefault(location, LocalTier())
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _sync(self):
+        tier = self._tier
+        now = time.monotonic()
+        if now < tier.next_sync:
+            return
+        state = self.shared.get_many([GENERATION_KEY, SEQUENCE_KEY])
+        if GENERATION_KEY not in state:
+            self._start_log()
+            state = self.shared.get_many([GENERATION_KEY, SEQUENCE_KEY])
+        generation = state.get(GENERATION_KEY)
+        sequence = state.get(SEQUENCE_KEY, 0)
+        with tier.lock:
+            tier.next_sync = now + self._sync_interval
+            if tier.sequence is None or generation != tier.generation:
+                self._drop_all(generation, sequence)
+                return
+            numbers = range(tier.sequence + 1, sequence + 1)
+            if len(numbers) > MAX_CHANGES_PER_SYNC:
+                self._drop_all(generation, sequence)
+                return
+            numbers = [number for number in numbers
+                       if number not in tier.own]
+        if not numbers:
+            return
+        changes = self.shared.get_many(
+            [CHANGE_KEY.format(number) for number in numbers])
+        with tier.lock:
+            if len(changes) < len(numbers):
+                # expired or not written yet: which keys changed is lost
+                self._drop_all(generation, sequence)
+                return
+            for keys in changes.values():
+                for local_key in keys:
+                    tier.entries.pop(local_key, None)
+            tier.own = {number for number in tier.own if number > sequence}
+            tier.sequence = max(tier.sequence, sequence)
+
+    def _drop_all(self, generation, sequence):
+        # called with the lock of the tier held
+        tier = self._tier
+        tier.entries.clear()
+        tier.generation = generation
+        tier.sequence = sequence
+        tier.own.clear()
+
+    def _new_generation(self):
+        # other processes drop all their local entries on the next sync
+        generation = uuid.uuid4().hex
+        self.shared.set(GENERATION_KEY, generation, None)
+        return generation
+
+    def _start_log(self):
+        # a fresh shared cache, or one that lost the generation: the
+        # processes that have seen another one drop their local tiers
+        self.shared.add(GENERATION_KEY, uuid.uuid4().hex, None)
+        self.shared.add(SEQUENCE_KEY, 0, None)
+
+    def _next_sequence(self):
+        try:
+            return self.shared.incr(SEQUENCE_KEY)
+        except ValueError:
+            if self.shared.get(GENERATION_KEY) is not None:
+                # the counter alone was evicted, and the log with it
+                self._new_generation()
+            self._start_log()
+            return self.shared.incr(SEQUENCE_KEY)
+
+    def _changed(self, keys, version):
+        """Log keys for the other processes to drop on the next sync."""
+        local_keys = [self.make_key(key, version) for key in keys]
+        if not local_keys:
+            return
+        # add() fails for a number taken by a concurrent writer,
+        # the incr() of some shared caches isn't atomic
+        for _ in range(MAX_LOG_ATTEMPTS):
+            number = self._next_sequence()
+            if self.shared.add(CHANGE_KEY.format(number), local_keys,
+                               CHANGE_LOG_TIMEOUT):
+                break
+        else:
+            # the counter keeps giving taken numbers: the other
+            # processes drop their whole local tiers instead
+            self._new_generation()
+            return
+        with self._tier.lock:
+            self._tier.own.add(number)
+
+    def _local_timeout_of(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self._local_timeout
+        return min(timeout, self._local_timeout)
+
+    def _remember(self, key, value, timeout, version):
+        local_key = self.make_key(key, version)
+        expires = time.monotonic() + self._local_timeout_of(timeout)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        entries = self._tier.entries
+        with self._tier.lock:
+            entries[local_key] = (expires, pickled)
+            entries.move_to_end(local_key)
+            while len(entries) > self._max_entries:
+                entries.popitem(last=False)
+
+    def _recall(self, key, version):
+        local_key = self.make_key(key, version)
+        entries = self._tier.entries
+        with self._tier.lock:
+            entry = entries.get(local_key)
+            if entry is None:
+                return False, None
+            expires, pickled = entry
+            if expires <= time.monotonic():
+                del entries[local_key]
+                return False, None
+            entries.move_to_end(local_key)
+        return True, pickle.loads(pickled)
+
+    def _forget(self, keys, version):
+        with self._tier.lock:
+            for key in keys:
+                self._tier.entries.pop(self.make_key(key, version), None)
+
+    def get(self, key, default=None, version=None):
+        self._sync()
+        found, value = self._recall(key, version)
+        if found:
+            return value
+        missing = object()
+        value = self.shared.get(key, missing, version=version)
+        if value is missing:
+            return default
+        self._remember(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        values = {}
+        misses = []
+        for key in keys:
+            found, value = self._recall(key, version)
+            if found:
+                values[key] = value
+            else:
+                misses.append(key)
+        if misses:
+            fetched = self.shared.get_many(misses, version=version)
+            for key, value in fetched.items():
+                self._remember(key, value, DEFAULT_TIMEOUT, version)
+            values.update(fetched)
+        return values
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._changed([key], version)
+            self._remember(key, value, timeout, version)
+        else:
+            self._forget([key], version)
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self._changed([key], version)
+        self._remember(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        self._changed(data, version)
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(key, value, timeout, version)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._forget([key], version)
+        value = self.shared.incr(key, delta, version=version)
+        self._changed([key], version)
+        return value
+
+    def delete(self, key, version=None):
+        self._forget([key], version)
+        self.shared.delete(key, version=version)
+        self._changed([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._forget(keys, version)
+        self.shared.delete_many(keys, version=version)
+        self._changed(keys, version)
+
+    def clear(self):
+        self.shared.clear()
+        generation = self._new_generation()
+        self.shared.add(SEQUENCE_KEY, 0, None)
+        with self._tier.lock:
+            self._drop_all(generation, 0)
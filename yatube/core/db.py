@@ -0,0 +1,14 @@
+"""SQLite tuning mode, see SQLITE_TUNING in settings."""
+from django.conf import settings
+
+
+def tune_sqlite(sender, connection, **kwargs):
+    """Run SQLITE_PRAGMAS on a new connection.
+
+    The pragmas go to the sqlite3 connection itself, past the cursor
+    wrappers, so they are not counted among the queries of a request.
+    """
+    if connection.vendor != 'sqlite' or not settings.SQLITE_TUNING:
+        return
+    for name, value in settings.SQLITE_PRAGMAS.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,182 @@
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from core.profiling import percentile
+from posts.models import Group, Post
+
+# the feeds are read from the database on every request
+NO_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+PERCENTILES = (50, 95)
+
+
+def copy_database(source, target):
+    """Copy an SQLite database, consistent even while it is written."""
+    with closing(sqlite3.connect(source)) as src, \
+            closing(sqlite3.connect(target)) as dst:
+        src.backup(dst)
+        # the journal mode is kept in the file, so both modes
+        # start from the default one
+        dst.execute('PRAGMA journal_mode = delete')
+
+
+def _read(paths, number, deadline):
+    rnd = random.Random(number)
+    client = Client()
+    while time.time() < deadline:
+        path = rnd.choice(paths)
+        yield lambda: client.get(path)
+
+
+def _write(author, number, deadline):
+    client = Client()
+    client.force_login(author)
+    url = reverse('posts:post_create')
+    sent = 0
+    while time.time() < deadline:
+        sent += 1
+        text = f'Нагрузочный пост {number}-{sent}'
+        yield lambda: client.post(url, {'text': text})
+
+
+def _work(requests, target, number, deadline):
+    """Make the requests of a worker process, return the kind of
+    the worker, the times of the requests in ms and the errors."""
+    samples, errors = [], 0
+    try:
+        for request in requests(target, number, deadline):
+            start = time.perf_counter()
+            try:
+                errors += request().status_code >= 400
+            except Exception:
+                # "database is locked" and the like
+                errors += 1
+                close_old_connections()
+            samples.append((time.perf_counter() - start) * 1000)
+    finally:
+        connections.close_all()
+    return requests.__name__.strip('_'), samples, errors
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает чтение лент и запись постов в несколько потоков '
+            'с SQLite по умолчанию и в режиме SQLITE_TUNING')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'database', nargs='?',
+            help='файл SQLite с данными, по умолчанию база проекта; '
+                 'сравниваются его копии')
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='секунд на каждый режим')
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument(
+            '--json', action='store_true', help='вывести отчёт в JSON')
+
+    def handle(self, *args, **options):
+        self.options = options
+        database = connections.databases['default']
+        source = options['database'] or database['NAME']
+        if database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Сравнение только для SQLite')
+        if not os.path.isfile(source):
+            raise CommandError(f'Нет файла базы {source}')
+
+        # the copies have the same rows, the targets are read once
+        targets = self.targets()
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            for mode, tuned in (('default', False), ('tuned', True)):
+                path = os.path.join(directory, f'{mode}.sqlite3')
+                copy_database(source, path)
+                results.append(self.run(mode, tuned, path, targets))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.print_report(results)
+
+    def run(self, mode, tuned, path, targets):
+        database = connections.databases['default']
+        saved = dict(database)
+        # wrappers of new connections are made from this dict
+        database.update(NAME=path, CONN_MAX_AGE=(
+            settings.SQLITE_CONN_MAX_AGE if tuned else 0))
+        try:
+            with override_settings(
+                    SQLITE_TUNING=tuned, CACHES=NO_CACHE, DEBUG=False,
+                    ALLOWED_HOSTS=['testserver'], THUMBNAIL_WORKERS=0):
+                return self.measure(mode, targets)
+        finally:
+            database.clear()
+            database.update(saved)
+
+    def targets(self):
+        post = Post.objects.select_related('author').first()
+        group = Group.objects.first()
+        if post is None or group is None:
+            raise CommandError(
+                'В базе нет постов или групп, запустите seed_load')
+        return {
+            'reads': [reverse('posts:index'),
+                      reverse('posts:group', args=[group.slug]),
+                      reverse('posts:profile', args=[post.author.username])],
+            'writer': post.author,
+        }
+
+    def measure(self, mode, targets):
+        tasks = [(_read, targets['reads'], number)
+                 for number in range(self.options['readers'])]
+        tasks += [(_write, targets['writer'], number)
+                  for number in range(self.options['writers'])]
+        # workers are processes, like the ones of a WSGI server:
+        # threads would wait for the GIL rather than for SQLite
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(len(tasks)) as pool:
+            start = time.monotonic()
+            deadline = time.time() + self.options['duration']
+            done = pool.starmap(_work, [(*task, deadline) for task in tasks])
+            elapsed = time.monotonic() - start
+
+        result = {'mode': mode}
+        for kind in ('read', 'write'):
+            samples = sorted(sample for done_kind, samples, _ in done
+                             if done_kind == kind for sample in samples)
+            result[f'{kind}s_per_second'] = round(len(samples) / elapsed, 1)
+            result[f'{kind}_errors'] = sum(
+                errors for done_kind, _, errors in done if done_kind == kind)
+            for percent in PERCENTILES:
+                value = percentile(samples, percent)
+                result[f'{kind}_p{percent}_ms'] = value and round(value, 2)
+        return result
+
+    def print_report(self, results):
+        columns = [column for column in results[0] if column != 'mode']
+        self.stdout.write(f'{"mode":<10}' + ''.join(
+            f'{column:>18}' for column in columns))
+        for result in results:
+            self.stdout.write(f'{result["mode"]:<10}' + ''.join(
+                f'{str(result[column]):>18}' for column in columns))
+        default, tuned = results
+        for kind in ('reads', 'writes'):
+            before = default[f'{kind}_per_second']
+            after = tuned[f'{kind}_per_second']
+            if before:
+                self.stdout.write(
+                    f'{kind}: в {after / before:.2f} раза больше '
+                    f'в режиме SQLITE_TUNING')
@@ -0,0 +1,210 @@
+import gzip
+import os
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+STATIC_DIR = settings.STATICFILES_DIRS[0]
+SOURCE = os.path.join(STATIC_DIR, 'css', 'bootstrap.min.css')
+PRUNED = os.path.join(STATIC_DIR, 'css', 'site.min.css')
+CRITICAL = os.path.join(
+    settings.TEMPLATES_DIR, 'includes', 'critical_css.html')
+# the templates of what every page shows first: its critical CSS
+CRITICAL_TEMPLATES = ('base.html', 'includes/header.html',
+                      'includes/footer.html')
+# at-rules holding rules rather than declarations
+NESTED = ('@media', '@supports', '@container', '@layer', '@document')
+GENERATED = '{# Создано manage.py build_css, не редактировать #}\n'
+
+TOKEN = re.compile(r'[\w-]+')
+CLASS = re.compile(r'\.((?:\\.|[\w-])+)')
+NOT = re.compile(r':not\([^()]*\)')
+ATTRIBUTE = re.compile(r'\[[^\]]*\]')
+
+
+def _skip_string(css, start):
+    quote, position = css[start], start + 1
+    while position < len(css) and css[position] != quote:
+        position += 2 if css[position] == '\\' else 1
+    return position + 1
+
+
+def _block_end(css, start):
+    """Position after the brace closing the block opened before start."""
+    depth, position = 1, start
+    while depth:
+        char = css[position]
+        if char in '"\'':
+            position = _skip_string(css, position)
+            continue
+        depth += {'{': 1, '}': -1}.get(char, 0)
+        position += 1
+    return position
+
+
+def strip_comments(css):
+    parts, start, position = [], 0, 0
+    while position < len(css):
+        if css[position] in '"\'':
+            position = _skip_string(css, position)
+        elif css.startswith('/*', position):
+            parts.append(css[start:position])
+            position = start = css.index('*/', position) + 2
+        else:
+            position += 1
+    parts.append(css[start:])
+    return ''.join(parts)
+
+
+def parse(css, start=0):
+    """Split css without comments into nodes (prelude, body): body is
+    a list of nodes in the at-rules of NESTED, the text inside the
+    braces in other rules and None in statements like @charset."""
+    nodes, prelude, position = [], start, start
+    while position < len(css):
+        char = css[position]
+        if char in '"\'':
+            position = _skip_string(css, position)
+        elif char == ';':
+            nodes.append((css[prelude:position].strip(), None))
+            position = prelude = position + 1
+        elif char == '{':
+            head = css[prelude:position].strip()
+            if head.startswith(NESTED):
+                body, position = parse(css, position + 1)
+            else:
+                end = _block_end(css, position + 1)
+                body, position = css[position + 1:end - 1], end
+            nodes.append((head, body))
+            prelude = position
+        elif char == '}':
+            return nodes, position + 1
+        else:
+            position += 1
+    return nodes, position
+
+
+def serialize(nodes):
+    parts = []
+    for prelude, body in nodes:
+        if body is None:
+            parts.append(f'{prelude};')
+        elif isinstance(body, list):
+            parts.append(f'{prelude}{{{serialize(body)}}}')
+        else:
+            parts.append(f'{prelude}{{{body}}}')
+    return ''.join(parts)
+
+
+def split_selectors(prelude):
+    selectors, depth, start = [], 0, 0
+    for position, char in enumerate(prelude):
+        depth += {'(': 1, '[': 1, ')': -1, ']': -1}.get(char, 0)
+        if char == ',' and not depth:
+            selectors.append(prelude[start:position])
+            start = position + 1
+    selectors.append(prelude[start:])
+    return selectors
+
+
+def selector_used(selector, used):
+    """Whether every class the selector needs is in used; the classes
+    inside :not() and attribute values are not needed."""
+    selector = NOT.sub('', ATTRIBUTE.sub('', selector))
+    return all(re.sub(r'\\(.)', r'\1', name) in used
+               for name in CLASS.findall(selector))
+
+
+def prune(nodes, used):
+    kept = []
+    for prelude, body in nodes:
+        if isinstance(body, list):
+            body = prune(body, used)
+            if body:
+                kept.append((prelude, body))
+        elif body is None or prelude.startswith('@'):
+            # @charset, @keyframes, @font-face and the like
+            kept.append((prelude, body))
+        else:
+            selectors = [selector for selector in split_selectors(prelude)
+                         if selector_used(selector, used)]
+            if selectors:
+                kept.append((','.join(selectors), body))
+    return kept
+
+
+def tokens(*paths):
+    """Every word of the files that may be a class name: classes are
+    also put together in {% if %} and passed to addclass."""
+    found = set()
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            found.update(TOKEN.findall(file.read()))
+    return found
+
+
+def files_under(directory, extensions):
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.endswith(extensions):
+                yield os.path.join(root, name)
+
+
+def size(text):
+    data = text.encode()
+    compressed = gzip.compress(data)
+    return f'{len(data) / 1024:.1f} КБ ({len(compressed) / 1024:.1f} КБ gzip)'
+
+
+class Command(BaseCommand):
+    help = ('Собирает из bootstrap.min.css стили классов, найденных '
+            'в шаблонах и скриптах, в static/css/site.min.css, а стили '
+            'первого экрана встраивает в base.html')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='только проверить, что собранные файлы не устарели')
+
+    def handle(self, *args, **options):
+        with open(SOURCE, encoding='utf-8') as file:
+            source = file.read()
+        # the license has to stay with the code
+        notice = re.search(r'/\*!.*?\*/', source, re.S)
+        notice = notice.group(0) + '\n' if notice else ''
+        nodes, _ = parse(strip_comments(source))
+
+        used = tokens(
+            *files_under(settings.TEMPLATES_DIR, ('.html', '.txt')),
+            *files_under(os.path.join(STATIC_DIR, 'js'), ('.js',)))
+        pruned = notice + serialize(prune(nodes, used))
+        critical = serialize(prune(nodes, tokens(*(
+            os.path.join(settings.TEMPLATES_DIR, name)
+            for name in CRITICAL_TEMPLATES))))
+        outputs = {
+            PRUNED: pruned + '\n',
+            CRITICAL: (f'{GENERATED}<style>{{% verbatim %}}{critical}'
+                       f'{{% endverbatim %}}</style>\n'),
+        }
+
+        if options['check']:
+            stale = [os.path.relpath(path, settings.BASE_DIR)
+                     for path, text in outputs.items()
+                     if not os.path.isfile(path) or _read(path) != text]
+            if stale:
+                raise CommandError(
+                    f'Устарели {", ".join(stale)}, '
+                    f'запустите manage.py build_css')
+            return
+        for path, text in outputs.items():
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(text)
+        self.stdout.write(f'bootstrap.min.css: {size(source)}')
+        self.stdout.write(f'site.min.css: {size(pruned)}')
+        self.stdout.write(f'встроено в base.html: {size(critical)}')
+
+
+def _read(path):
+    with open(path, encoding='utf-8') as file:
+        return file.read()
@@ -0,0 +1,56 @@
+import glob
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    help = 'Печатает профиль запросов по view, собранный ProfilingMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--json', action='store_true', help='вывести отчёт в JSON')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='удалить записанные профили после отчёта')
+
+    def handle(self, *args, **options):
+        rows = profiling.report_rows(profiling.collect())
+        if options['json']:
+            self.stdout.write(json.dumps(rows, ensure_ascii=False, indent=2))
+        elif not rows:
+            self.stderr.write(
+                f'В {settings.PERF_PROFILING_DIR} нет профилей, '
+                'запустите сервер с YATUBE_PERF_PROFILING=1.')
+        else:
+            self.write_table(rows)
+        if options['clear']:
+            for path in glob.glob(os.path.join(
+                    settings.PERF_PROFILING_DIR, 'perf-*.json')):
+                os.remove(path)
+
+    def write_table(self, rows):
+        self.stdout.write(
+            f'{"view":<28}{"req":>7}{"sql":>7}{"sql p95":>9}'
+            f'{"sql ms":>10}{"tpl ms":>9}{"p50 ms":>9}{"p95 ms":>9}'
+            f'{"kb":>8}{"dup":>6}')
+        for row in rows:
+            self.stdout.write(
+                f'{row["view"]:<28}{row["requests"]:>7}'
+                f'{row["queries_mean"]:>7.1f}'
+                f'{self.bound(row["queries_p95"]):>9}'
+                f'{row["sql_ms_total"]:>10.0f}{row["render_ms_mean"]:>9.1f}'
+                f'{self.bound(row["total_ms_p50"]):>9}'
+                f'{self.bound(row["total_ms_p95"]):>9}'
+                f'{row["size_kb_mean"]:>8.1f}{row["duplicates_mean"]:>6.1f}')
+            for sql, times in row['repeated']:
+                self.stdout.write(
+                    self.style.WARNING(f'    N+1, {times} раз: {sql}'))
+
+    def bound(self, value):
+        # the percentile fell into the unbounded bucket
+        return '>' if value is None else value
@@ -0,0 +1,292 @@
+"""Per-view profile of SQL, template rendering and response size.
+
+ProfilingMiddleware is switched on by PERF_PROFILING. For every request
+it records the number and the time of SQL queries, the repeated ones
+(the same SQL run again: exact duplicates and N+1 loops), the time of
+template rendering and the size of the response. The numbers are
+aggregated per resolved view name into histograms with fixed buckets.
+
+Every process writes its histograms as JSON into PERF_PROFILING_DIR
+at most once in PERF_PROFILING_DUMP_INTERVAL seconds. The /_perf/ page
+and `manage.py perf_report` merge the dumps of all the workers.
+"""
+import glob
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+
+# upper bounds of the buckets, the last bucket is unbounded
+MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+KB_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+# a query run this many times in one request is reported as N+1
+REPEATED_THRESHOLD = 3
+# SQL samples kept for every view
+TOP_REPEATED = 5
+
+_current = threading.local()
+_lock = threading.Lock()
+_stats = {}
+_next_dump = 0
+
+
+def percentile(values, percent):
+    """Exact nearest-rank percentile of sorted values, for the load
+    tests keeping every sample."""
+    if not values:
+        return None
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+class Histogram:
+    def __init__(self, bounds, counts=None, total=0):
+        self.bounds = tuple(bounds)
+        self.counts = list(counts or [0] * (len(bounds) + 1))
+        self.total = total
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, share):
+        """Upper bound of the bucket holding the percentile, None if
+        it falls into the unbounded bucket."""
+        rank = share * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {'bounds': self.bounds, 'counts': self.counts,
+                'total': self.total}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['bounds'], data['counts'], data['total'])
+
+
+class ViewStats:
+    HISTOGRAMS = {
+        'queries': COUNT_BUCKETS,
+        'sql_ms': MS_BUCKETS,
+        'render_ms': MS_BUCKETS,
+        'total_ms': MS_BUCKETS,
+        'size_kb': KB_BUCKETS,
+        'duplicates': COUNT_BUCKETS,
+    }
+
+    def __init__(self):
+        self.histograms = {name: Histogram(bounds)
+                           for name, bounds in self.HISTOGRAMS.items()}
+        # SQL run REPEATED_THRESHOLD times or more: the most times
+        # it was seen in one request
+        self.repeated = Counter()
+
+    @property
+    def requests(self):
+        return self.histograms['total_ms'].count
+
+    def add(self, sample):
+        for name, histogram in self.histograms.items():
+            histogram.add(sample[name])
+        for sql, times in sample['repeated'].items():
+            self.repeated[sql] = max(self.repeated[sql], times)
+
+    def merge(self, other):
+        for name, histogram in self.histograms.items():
+            histogram.merge(other.histograms[name])
+        for sql, times in other.repeated.items():
+            self.repeated[sql] = max(self.repeated[sql], times)
+
+    def as_dict(self):
+        return {
+            'histograms': {name: histogram.as_dict()
+                           for name, histogram in self.histograms.items()},
+            'repeated': dict(self.repeated.most_common(TOP_REPEATED)),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.histograms = {
+            name: Histogram.from_dict(histogram)
+            for name, histogram in data['histograms'].items()}
+        stats.repeated = Counter(data['repeated'])
+        return stats
+
+
+class RequestProfile:
+    """Numbers of the request being served by the current thread."""
+
+    def __init__(self):
+        self.queries = Counter()
+        self.templates = Counter()
+        self.sql_ms = 0
+        self.render_ms = 0
+        # templates rendered inside other templates, e.g. post
+        # cards, are timed as a part of the outer one
+        self.render_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # installed with connection.execute_wrapper()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_ms += (time.perf_counter() - start) * 1000
+            self.queries[sql, repr(params)] += 1
+            self.templates[sql] += 1
+
+    def sample(self, total_ms, size):
+        return {
+            'queries': sum(self.queries.values()),
+            'sql_ms': self.sql_ms,
+            'render_ms': self.render_ms,
+            'total_ms': total_ms,
+            'size_kb': size / 1024,
+            'duplicates': sum(
+                times - 1 for times in self.queries.values()),
+            'repeated': {sql: times for sql, times in self.templates.items()
+                         if times >= REPEATED_THRESHOLD},
+        }
+
+
+_render = Template.render
+
+
+def _timed_render(self, context=None, request=None):
+    profile = getattr(_current, 'profile', None)
+    if profile is None or profile.render_depth:
+        return _render(self, context, request)
+    profile.render_depth += 1
+    start = time.perf_counter()
+    try:
+        return _render(self, context, request)
+    finally:
+        profile.render_ms += (time.perf_counter() - start) * 1000
+        profile.render_depth -= 1
+
+
+def record(view_name, sample):
+    global _next_dump
+    with _lock:
+        _stats.setdefault(view_name, ViewStats()).add(sample)
+        now = time.monotonic()
+        if now < _next_dump:
+            return
+        _next_dump = now + settings.PERF_PROFILING_DUMP_INTERVAL
+    dump()
+
+
+def dump_path(pid=None):
+    return os.path.join(settings.PERF_PROFILING_DIR,
+                        f'perf-{pid or os.getpid()}.json')
+
+
+def dump():
+    with _lock:
+        data = {name: stats.as_dict() for name, stats in _stats.items()}
+    os.makedirs(settings.PERF_PROFILING_DIR, exist_ok=True)
+    path = dump_path()
+    with open(path + '.tmp', 'w') as dump_file:
+        json.dump(data, dump_file)
+    os.replace(path + '.tmp', path)
+
+
+def collect():
+    """Stats of every view merged over all the processes."""
+    merged = {}
+    own_dump = dump_path()
+    paths = glob.glob(os.path.join(settings.PERF_PROFILING_DIR,
+                                   'perf-*.json'))
+    for path in paths:
+        if path == own_dump:
+            continue
+        try:
+            with open(path) as dump_file:
+                data = json.load(dump_file)
+        except (OSError, ValueError):
+            continue
+        for name, stats in data.items():
+            merged.setdefault(name, ViewStats()).merge(
+                ViewStats.from_dict(stats))
+    with _lock:
+        for name, stats in _stats.items():
+            merged.setdefault(name, ViewStats()).merge(stats)
+    return merged
+
+
+def report_rows(merged):
+    """Views with their summary numbers, the slowest in total first."""
+    rows = []
+    for name, stats in merged.items():
+        histograms = stats.histograms
+        rows.append({
+            'view': name,
+            'requests': stats.requests,
+            'queries_mean': histograms['queries'].mean,
+            'queries_p95': histograms['queries'].percentile(0.95),
+            'sql_ms_total': histograms['sql_ms'].total,
+            'sql_ms_mean': histograms['sql_ms'].mean,
+            'render_ms_mean': histograms['render_ms'].mean,
+            'total_ms_p50': histograms['total_ms'].percentile(0.5),
+            'total_ms_p95': histograms['total_ms'].percentile(0.95),
+            'size_kb_mean': histograms['size_kb'].mean,
+            'duplicates_mean': histograms['duplicates'].mean,
+            'repeated': stats.repeated.most_common(TOP_REPEATED),
+        })
+    rows.sort(key=lambda row: row['sql_ms_total'], reverse=True)
+    return rows
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.PERF_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        Template.render = _timed_render
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        _current.profile = profile
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current.profile = None
+        total_ms = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        record(view_name, profile.sample(total_ms, size))
+        return response
@@ -0,0 +1,108 @@
+"""Routing of the feed reads to the replicas of the database.
+
+Only the views wrapped in replica_reads() read from DATABASE_REPLICAS,
+every other query and every write goes to the default database. The
+replicas may lag behind it for up to REPLICA_LAG seconds, so
+
+- a user is pinned to the default database for that long after a
+  write of theirs and reads their own writes: the middleware pins
+  after unsafe requests, pins_primary() after the views writing on GET;
+- a page whose feed changed that recently calls use_primary(), as
+  its fragments are cached under the new version of the feed.
+"""
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_KEY = 'replica_pin_until'
+# read before and written after the views, or read back right after
+# a write like the counters of the database cache: always on the primary
+PRIMARY_APPS = {'sessions', 'django_cache'}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_state = threading.local()
+
+
+def reading_replica():
+    """Alias of the replica the current request reads from, if any."""
+    return getattr(_state, 'replica', None)
+
+
+def use_primary():
+    """Read the rest of the current request from the primary."""
+    _state.replica = None
+
+
+def pin(request):
+    if settings.DATABASE_REPLICAS:
+        request.session[PIN_KEY] = time.time() + settings.REPLICA_LAG
+
+
+def pinned(request):
+    return request.session.get(PIN_KEY, 0) > time.time()
+
+
+def replica_reads(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.DATABASE_REPLICAS or pinned(request):
+            return view(request, *args, **kwargs)
+        # one replica for the whole request: replicas lag differently,
+        # and the parts of a page have to be read at one moment
+        _state.replica = random.choice(settings.DATABASE_REPLICAS)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _state.replica = None
+    return wrapper
+
+
+def pins_primary(view):
+    """Pin the user after a view writing on a GET request."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        pin(request)
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replica = reading_replica()
+        if replica and model._meta.app_label not in PRIMARY_APPS:
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # the replicas get the schema with the data
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaPinMiddleware:
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin(request)
+        return response
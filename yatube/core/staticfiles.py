@@ -0,0 +1,181 @@
+"""Static files with content-hashed names, compressed ahead of time.
+
+collectstatic copies every file to STATIC_ROOT under its hashed name
+too (css/bootstrap.min.<hash>.css) and writes gzip and, if the brotli
+package is installed, brotli siblings of the text files next to them.
+StaticFilesLayer serves STATIC_ROOT in front of Django: the variant
+the client accepts and, for the hashed names, a far-future immutable
+Cache-Control, so no CDN or web server setup is needed.
+"""
+import gzip
+import json
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+                                                StaticFilesStorage)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.xml',
+                '.ico', '.map')
+# encodings in the order of preference, with the suffixes of the files
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# a compressed copy saving less is not worth a request header more
+MIN_SAVING = 0.05
+
+
+def compress(data):
+    """{suffix: compressed data} of the encodings worth serving."""
+    siblings = {'.gz': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        siblings['.br'] = brotli.compress(data)
+    return {suffix: compressed for suffix, compressed in siblings.items()
+            if len(compressed) < len(data) * (1 - MIN_SAVING)}
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+
+    def url(self, name, force=False):
+        if not self.hashed_files:
+            # nothing is collected yet: the tests and the development
+            # server with DEBUG off read the files from the finders
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            with self.open(name) as file:
+                data = file.read()
+            for suffix in dict(ENCODINGS).values():
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+            for suffix, compressed in compress(data).items():
+                with open(self.path(name + suffix), 'wb') as file:
+                    file.write(compressed)
+
+
+class StaticFile:
+
+    def __init__(self, path, immutable):
+        self.path = path
+        self.immutable = immutable
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type.endswith(
+                ('javascript', 'json', 'xml')):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        stat = os.stat(path)
+        self.modified = int(stat.st_mtime)
+        self.encodings = [(encoding, path + suffix)
+                          for encoding, suffix in ENCODINGS
+                          if os.path.isfile(path + suffix)]
+
+
+def accepted_encodings(environ):
+    accepted = set()
+    for part in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        encoding, _, params = part.strip().partition(';')
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    # q=0 refuses the encoding
+                    continue
+            except ValueError:
+                continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+class StaticFilesLayer:
+    """WSGI middleware serving the files collected to STATIC_ROOT.
+
+    The files are listed once at start, so a collectstatic takes
+    effect after a restart, like the rest of a deploy. Requests for
+    anything else go to the wrapped application.
+    """
+
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.root = root or settings.STATIC_ROOT
+        self.prefix = prefix or settings.STATIC_URL
+        self.files = self.scan() if self.root else {}
+
+    def scan(self):
+        if not os.path.isdir(self.root):
+            return {}
+        manifest = os.path.join(self.root, 'staticfiles.json')
+        hashed = set()
+        if os.path.isfile(manifest):
+            with open(manifest, encoding='utf-8') as file:
+                hashed = set(json.load(file).get('paths', {}).values())
+        suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        files = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(suffixes) or name == 'staticfiles.json':
+                    continue
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root).replace(
+                    os.sep, '/')
+                files[self.prefix + relative] = StaticFile(
+                    path, relative in hashed)
+        return files
+
+    def __call__(self, environ, start_response):
+        file = self.files.get(environ.get('PATH_INFO', ''))
+        if file is None or environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+
+        headers = [('Content-Type', file.content_type),
+                   ('Last-Modified', formatdate(file.modified, usegmt=True))]
+        if file.immutable:
+            headers.append(('Cache-Control', (
+                f'public, max-age={settings.STATIC_IMMUTABLE_MAX_AGE}, '
+                f'immutable')))
+        else:
+            headers.append(('Cache-Control',
+                            f'public, max-age={settings.STATIC_MAX_AGE}'))
+        if file.encodings:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if not file.immutable and not_modified(environ, file.modified):
+            start_response('304 Not Modified', headers)
+            return []
+
+        path = file.path
+        accepted = accepted_encodings(environ)
+        for encoding, encoded in file.encodings:
+            if encoding in accepted:
+                path = encoded
+                headers.append(('Content-Encoding', encoding))
+                break
+        headers.append(('Content-Length', str(os.path.getsize(path))))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+        return wrapper(open(path, 'rb'))
+
+
+def not_modified(environ, modified):
+    since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if not since:
+        return False
+    try:
+        return parsedate_to_datetime(since).timestamp() >= modified
+    except (TypeError, ValueError):
+        return False
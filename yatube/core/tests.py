@@ -0,0 +1,377 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.template.loader import render_to_string
+from django.templatetags.static import static
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+
+from . import profiling
+from .cache import TwoTierCache, _tiers
+from .management.commands.build_css import (
+    CRITICAL, parse, prune, serialize, strip_comments)
+from .management.commands.bench_sqlite import copy_database
+from .staticfiles import StaticFilesLayer, brotli
+from .views import serve_media
+
+SHARED = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'two-tier-tests',
+}
+
+
+@override_settings(CACHES={**settings.CACHES, 'two-tier-shared': SHARED})
+class TwoTierCacheTests(SimpleTestCase):
+
+    def worker(self, name, **options):
+        # a separate local tier stands for another process
+        _tiers.pop(name, None)
+        return TwoTierCache(name, {'OPTIONS': {
+            'SHARED': 'two-tier-shared', 'SYNC_INTERVAL': 0, **options}})
+
+    def setUp(self):
+        self.first = self.worker('first')
+        self.second = self.worker('second')
+        self.first.clear()
+
+    def test_hits_are_local(self):
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.second.shared.delete('key')
+        self.assertEqual(self.second.get('key'), 'value')
+
+    def test_writes_reach_other_processes(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+        self.first.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.second.get_many(['a', 'b', 'c']),
+                         {'a': 1, 'b': 2})
+
+    # only the changed keys are dropped in the other processes
+    def test_unrelated_writes_keep_local_entries(self):
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.second.shared.delete('key')
+        self.first.set('other', 1)
+        self.first.set('other', 2)
+        self.first.set_many({'a': 1, 'b': 2})
+        self.first.delete('a')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertEqual(self.second.get('other'), 2)
+
+    # a key evicted from the shared cache is still held locally
+    # elsewhere, writing it anew reaches the other processes
+    def test_writes_after_eviction_reach_other_processes(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.shared.delete('key')
+        self.assertTrue(self.first.add('key', 'added'))
+        self.assertEqual(self.second.get('key'), 'added')
+        self.first.shared.delete('key')
+        self.first.set('key', 'set')
+        self.assertEqual(self.second.get('key'), 'set')
+        self.first.shared.delete('key')
+        self.first.set_many({'key': 'set_many'})
+        self.assertEqual(self.second.get('key'), 'set_many')
+
+    def test_local_tier_is_bounded(self):
+        cache = self.worker('small', MAX_ENTRIES=2)
+        cache.set_many({'a': 1, 'b': 2})
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(list(cache._tier.entries),
+                         [cache.make_key('a'), cache.make_key('c')])
+
+    def test_add(self):
+        self.assertTrue(self.first.add('key', 'first'))
+        self.assertFalse(self.second.add('key', 'second'))
+        self.assertEqual(self.second.get('key'), 'first')
+
+
+PERF_DIR = tempfile.mkdtemp()
+
+
+@override_settings(PERF_PROFILING=True, PERF_PROFILING_DIR=PERF_DIR)
+class ProfilingTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(PERF_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        profiling._stats.clear()
+        self.staff = get_user_model().objects.create(
+            username='staff', is_staff=True)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(profiling.percentile(values, 50), 50)
+        self.assertEqual(profiling.percentile(values, 99), 99)
+        self.assertEqual(profiling.percentile([7], 95), 7)
+        self.assertIsNone(profiling.percentile([], 50))
+
+    def test_views_profiled(self):
+        self.client.get('/')
+        self.client.get('/')
+        stats = profiling._stats['posts:index']
+        self.assertEqual(stats.requests, 2)
+        self.assertGreater(stats.histograms['queries'].total, 0)
+        self.assertGreater(stats.histograms['render_ms'].total, 0)
+        self.assertGreater(stats.histograms['size_kb'].total, 0)
+
+    def test_repeated_queries_detected(self):
+        profile = profiling.RequestProfile()
+        for pk in range(profiling.REPEATED_THRESHOLD):
+            profile(lambda *args: None, 'SELECT %s', (pk,), False, {})
+        profile(lambda *args: None, 'SELECT %s', (0,), False, {})
+        sample = profile.sample(1, 0)
+        self.assertEqual(sample['duplicates'], 1)
+        self.assertEqual(sample['repeated'], {'SELECT %s': 4})
+
+    def test_report_page_for_staff_only(self):
+        self.client.get('/')
+        response = self.client.get('/_perf/')
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get('/_perf/')
+        self.assertContains(response, 'posts:index')
+
+    # a p95 of no queries is a number, only the overflow bucket is '>'
+    def test_report_page_zero_bounds(self):
+        request = RequestFactory().get('/_perf/')
+        request.user = self.staff
+        row = {'view': 'posts:index', 'queries_p95': 0,
+               'total_ms_p50': 5, 'total_ms_p95': None, 'repeated': []}
+        html = render_to_string('core/perf.html', {'rows': [row]},
+                                request=request)
+        self.assertInHTML('<td>0</td>', html)
+        self.assertInHTML('<td>&gt;</td>', html)
+
+    def test_report_command(self):
+        self.client.get('/')
+        profiling.dump()
+        out = StringIO()
+        call_command('perf_report', stdout=out)
+        self.assertIn('posts:index', out.getvalue())
+
+
+class SqliteTuningTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'db.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def pragmas(self):
+        wrapper = DatabaseWrapper(
+            {**connection.settings_dict, 'NAME': self.path}, 'tuning')
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+                cursor.execute('PRAGMA synchronous')
+                synchronous = cursor.fetchone()[0]
+            return journal_mode, synchronous, len(wrapper.queries_log)
+        finally:
+            wrapper.close()
+
+    @override_settings(SQLITE_TUNING=True)
+    def test_pragmas_on_new_connection(self):
+        journal_mode, synchronous, _ = self.pragmas()
+        self.assertEqual(journal_mode, 'wal')
+        # 1 is NORMAL
+        self.assertEqual(synchronous, 1)
+
+    @override_settings(SQLITE_TUNING=True, DEBUG=True)
+    def test_pragmas_not_logged(self):
+        self.assertEqual(self.pragmas()[2], 2)
+
+    @override_settings(SQLITE_TUNING=False)
+    def test_off_by_default(self):
+        self.assertEqual(self.pragmas()[0], 'delete')
+
+    def test_copy_resets_journal_mode(self):
+        with closing(sqlite3.connect(self.path)) as db:
+            db.execute('PRAGMA journal_mode = wal')
+            db.execute('CREATE TABLE rows (value)')
+            db.execute('INSERT INTO rows VALUES (1)')
+            db.commit()
+        copy = os.path.join(self.directory, 'copy.sqlite3')
+        copy_database(self.path, copy)
+        with closing(sqlite3.connect(copy)) as db:
+            self.assertEqual(
+                db.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+            self.assertEqual(
+                db.execute('SELECT value FROM rows').fetchall(), [(1,)])
+
+
+class ServeMediaTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.hashed = 'posts/ab/' + 'c' * 62 + '.jpg'
+        for name in (self.hashed, 'posts/photo.jpg'):
+            os.makedirs(os.path.join(self.root, os.path.dirname(name)),
+                        exist_ok=True)
+            with open(os.path.join(self.root, name), 'wb') as file:
+                file.write(b'image')
+
+    def get(self, name):
+        request = RequestFactory().get('/media/' + name)
+        return serve_media(request, name, document_root=self.root)
+
+    # content-hashed names are cached for good, the others as before
+    def test_hashed_names_immutable(self):
+        cache_control = self.get(self.hashed)['Cache-Control']
+        self.assertIn('immutable', cache_control)
+        self.assertIn(f'max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}',
+                      cache_control)
+        self.assertFalse(self.get('posts/photo.jpg').has_header(
+            'Cache-Control'))
+
+
+STATIC_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(STATIC_ROOT=STATIC_ROOT, DEBUG=False)
+class StaticFilesTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.layer = StaticFilesLayer(cls.application)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(STATIC_ROOT, ignore_errors=True)
+
+    @staticmethod
+    def application(environ, start_response):
+        start_response('200 OK', [('X-Django', 'yes')])
+        return [b'django']
+
+    def get(self, path, **headers):
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        body = b''.join(self.layer({'PATH_INFO': path,
+                                    'REQUEST_METHOD': 'GET', **headers},
+                                   start_response))
+        return response['status'], response['headers'], body
+
+    def test_hashed_names(self):
+        url = static('css/bootstrap.min.css')
+        self.assertRegex(
+            url, r'^/static/css/bootstrap\.min\.[0-9a-f]{12}\.css$')
+        path = os.path.join(STATIC_ROOT, url[len('/static/'):])
+        with open(path, 'rb') as file, gzip.open(path + '.gz') as packed:
+            self.assertEqual(packed.read(), file.read())
+        self.assertEqual(os.path.exists(path + '.br'), brotli is not None)
+        # images are compressed already
+        self.assertFalse(os.path.exists(
+            os.path.join(STATIC_ROOT, 'img', 'logo.png.gz')))
+
+    def test_layer_serves_precompressed(self):
+        url = static('css/bootstrap.min.css')
+        status, headers, body = self.get(
+            url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', headers['Cache-Control'])
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        self.assertIn(b'bootstrap', gzip.decompress(body))
+
+        status, headers, body = self.get(
+            url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertIn(b'bootstrap', body)
+
+    def test_plain_names_revalidated(self):
+        status, headers, _ = self.get('/static/css/bootstrap.min.css')
+        self.assertEqual(headers['Cache-Control'],
+                         f'public, max-age={settings.STATIC_MAX_AGE}')
+        status, _, body = self.get(
+            '/static/css/bootstrap.min.css',
+            HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+        self.assertEqual((status, body), ('304 Not Modified', b''))
+
+    def test_other_requests_go_to_django(self):
+        for path in ('/', '/static/missing.css'):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path)[2], b'django')
+
+    # the tests and DEBUG off without collectstatic get the plain names
+    def test_not_collected(self):
+        with tempfile.TemporaryDirectory() as root, \
+                self.settings(STATIC_ROOT=root):
+            self.assertEqual(static('css/bootstrap.min.css'),
+                             '/static/css/bootstrap.min.css')
+
+
+class BuildCssTests(SimpleTestCase):
+
+    def prune(self, css, *used):
+        nodes, _ = parse(strip_comments(css))
+        return serialize(prune(nodes, set(used)))
+
+    def test_outputs_up_to_date(self):
+        # run manage.py build_css after changing templates or scripts
+        call_command('build_css', check=True)
+
+    def test_unused_classes_dropped(self):
+        self.assertEqual(
+            self.prune('.btn{color:red}.card{margin:0}p,.alert{top:0}',
+                       'btn'),
+            '.btn{color:red}p{top:0}')
+        self.assertEqual(
+            self.prune('.nav .nav-link.active{x:1}', 'nav', 'nav-link'), '')
+
+    def test_not_and_attributes_ignored(self):
+        self.assertEqual(
+            self.prune('.btn:not(.disabled),[class*=col-]{x:1}', 'btn'),
+            '.btn:not(.disabled),[class*=col-]{x:1}')
+
+    def test_at_rules(self):
+        css = ('@charset "UTF-8";/* note */@media (min-width:576px)'
+               '{.card{x:1}.btn{y:2}}@supports (x:y){.card{z:3}}'
+               '@keyframes spin{to{transform:rotate(1turn)}}')
+        self.assertEqual(
+            self.prune(css, 'btn'),
+            '@charset "UTF-8";@media (min-width:576px){.btn{y:2}}'
+            '@keyframes spin{to{transform:rotate(1turn)}}')
+
+    def test_base_inlines_critical_css(self):
+        with open(CRITICAL, encoding='utf-8') as file:
+            critical = file.read()
+        self.assertIn('.navbar{', critical)
+        self.assertNotIn('.card{', critical)
+        response = self.client.get('/about/author/')
+        self.assertContains(response, '<style>')
+        self.assertContains(response, 'css/site.min.css')
+        self.assertNotContains(response, '{% verbatim %}')
+        self.assertNotContains(response, 'bootstrap.min.css')
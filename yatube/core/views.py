@@ -1,4 +1,12 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+from posts.storage import is_hashed
+
+from . import profiling
 
 
 def page_not_found(request, exception):
@@ -17,3 +25,19 @@ def access_error(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def perf_report(request):
+    rows = profiling.report_rows(profiling.collect())
+    return render(request, 'core/perf.html', {'rows': rows})
+
+
+def serve_media(request, path, document_root=None):
+    """Media files of the development server; a content-hashed name
+    never changes its content, so browsers may keep it for good."""
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200 and is_hashed(path):
+        patch_cache_control(response, public=True, immutable=True,
+                            max_age=settings.MEDIA_IMMUTABLE_MAX_AGE)
+    return response
@@ -0,0 +1,186 @@
+"""Read-only JSON API of the feeds, posts and comments.
+
+Pages are cut by cursors like the HTML feeds. `?fields=id,text` limits
+the fields of every item. Responses carry a strong ETag and
+Last-Modified (posts/conditional.py); for the feeds they are built
+from the feed versions in posts/cache.py, so a revalidation of an
+unchanged page is answered with 304 before any post is read.
+"""
+from functools import wraps
+
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_safe
+from django.views.decorators.vary import vary_on_cookie
+
+from .conditional import (conditional, feed_state, post_state,
+                          with_last_comment)
+from .follows import followed_authors
+from .models import Group, Post, User
+from .timeline import follow_feed, follow_paginator
+from .utils import KeysetPaginator, paginate_comments, paginate_page
+
+POST_FIELDS = {
+    'id': lambda post: post.pk,
+    'text': lambda post: post.text,
+    'author': lambda post: post.author.username,
+    'group': lambda post: post.group and post.group.slug,
+    'pub_date': lambda post: post.pub_date,
+    'updated': lambda post: post.updated,
+    'image': lambda post: post.image.url if post.image else None,
+    'thumbnail': lambda post: post.thumbnail or None,
+    'comment_count': lambda post: post.comment_count,
+    'url': lambda post: reverse('posts:post_detail', args=[post.pk]),
+}
+COMMENT_FIELDS = {
+    'id': lambda comment: comment.pk,
+    'post': lambda comment: comment.post_id,
+    'author': lambda comment: comment.author.username,
+    'text': lambda comment: comment.text,
+    'created': lambda comment: comment.created,
+}
+# relations read only when their fields are asked for
+POST_RELATIONS = {'author': 'author', 'group': 'group'}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def selected_fields(request, known):
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(known)
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = set(fields) - set(known)
+    if unknown:
+        raise BadRequest('Неизвестные поля: ' + ', '.join(sorted(unknown)))
+    return fields
+
+
+def serialize(obj, fields, known):
+    return {field: known[field](obj) for field in fields}
+
+
+def api_view(view):
+    """Turn BadRequest into a JSON 400 response."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return JsonResponse({'error': str(error)}, status=400)
+    return wrapper
+
+
+def feed_response(request, post_list, paginator_class=KeysetPaginator):
+    fields = selected_fields(request, POST_FIELDS)
+    relations = [POST_RELATIONS[field]
+                 for field in fields if field in POST_RELATIONS]
+    page_obj = paginate_page(request, post_list.select_related(*relations),
+                             paginator_class=paginator_class)
+    return JsonResponse({
+        'results': [serialize(post, fields, POST_FIELDS)
+                    for post in page_obj],
+        'next': getattr(page_obj, 'next_cursor', None),
+        'previous': getattr(page_obj, 'previous_cursor', None),
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+def _feed_validators(kind):
+    def validators(request, slug=None, username=None):
+        # the group and the author are kept for the view
+        # after condition() has let the request through
+        if kind == 'index':
+            return feed_state(('index',))
+        if kind == 'group':
+            request._api_target = get_object_or_404(Group, slug=slug)
+            return feed_state(('group', request._api_target.pk))
+        if kind == 'profile':
+            request._api_target = get_object_or_404(
+                User, username=username)
+            return feed_state(('profile', request._api_target.pk))
+        if not request.user.is_authenticated:
+            return None, None
+        # the feed changes with the posts of every followed
+        # author and with the follows of the user
+        authors = sorted(followed_authors(request.user.pk))
+        versions, changed = feed_state(
+            ('profile', request.user.pk),
+            *(('profile', author) for author in authors))
+        return [f'user={request.user.pk}', *versions], changed
+    return validators
+
+
+def post_validators(request, post_id):
+    request._api_target = get_object_or_404(
+        with_last_comment(Post.objects.select_related('author', 'group')),
+        pk=post_id)
+    return post_state(request._api_target)
+
+
+@require_safe
+@cache_control(no_cache=True)
+@conditional(_feed_validators('index'))
+@api_view
+def index(request):
+    return feed_response(request, Post.objects.all())
+
+
+@require_safe
+@cache_control(no_cache=True)
+@conditional(_feed_validators('group'))
+@api_view
+def group_posts(request, slug):
+    return feed_response(
+        request, request._api_target.posts_in_group.all())
+
+
+@require_safe
+@cache_control(no_cache=True)
+@conditional(_feed_validators('profile'))
+@api_view
+def profile(request, username):
+    return feed_response(
+        request, request._api_target.posts_of_author.all())
+
+
+@require_safe
+@cache_control(private=True, no_cache=True)
+@vary_on_cookie
+@conditional(_feed_validators('follow'))
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Нужна авторизация'}, status=401)
+    return feed_response(request, follow_feed(request.user),
+                         follow_paginator(request.user))
+
+
+@require_safe
+@cache_control(no_cache=True)
+@conditional(post_validators)
+@api_view
+def post_detail(request, post_id):
+    fields = selected_fields(request, POST_FIELDS)
+    return JsonResponse(
+        serialize(request._api_target, fields, POST_FIELDS),
+        json_dumps_params={'ensure_ascii': False})
+
+
+@require_safe
+@cache_control(no_cache=True)
+@conditional(post_validators)
+@api_view
+def comments(request, post_id):
+    fields = selected_fields(request, COMMENT_FIELDS)
+    post = request._api_target
+    page_obj = paginate_comments(
+        request, post.comments_to_post.select_related('author'))
+    return JsonResponse({
+        'results': [serialize(comment, fields, COMMENT_FIELDS)
+                    for comment in page_obj],
+        'next': page_obj.next_cursor,
+    }, json_dumps_params={'ensure_ascii': False})
@@ -0,0 +1,70 @@
+"""Writes of many rows at once.
+
+Neither bulk_create nor insert_rows() send signals, so the commands
+using them write the search entries themselves and recount the
+counters when they are done.
+"""
+from contextlib import contextmanager
+
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+
+from .models import Comment, Post
+
+
+@contextmanager
+def keep_dates():
+    # bulk_create would stamp the written rows with the current time
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def next_id(model):
+    # bulk_create doesn't return ids on SQLite, so the commands
+    # give them and write every batch in a transaction
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+def reset_sequences(*models):
+    """Move the id sequences past the ids given by the commands."""
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+def insert_rows(model, fields, rows, ignore_conflicts=False):
+    """Insert rows, tuples of the values of fields, by one executemany.
+
+    It skips the model instances and the SQL compiler that bulk_create
+    goes through for every row, which is most of its time on narrow
+    tables like the search index and the timelines. The values are
+    written as they are, so they must be plain numbers and strings.
+    """
+    ops = connection.ops
+    columns = [ops.quote_name(model._meta.get_field(field).column)
+               for field in fields]
+    sql = '{} {} ({}) VALUES ({}) {}'.format(
+        ops.insert_statement(ignore_conflicts=ignore_conflicts),
+        ops.quote_name(model._meta.db_table), ', '.join(columns),
+        ', '.join(['%s'] * len(columns)),
+        ops.ignore_conflicts_suffix_sql(ignore_conflicts=ignore_conflicts))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+SEARCH_FIELDS = ('term', 'post', 'comment', 'weight')
+
+
+def search_entries(post_id, comment_id, terms, weight):
+    """Rows of SEARCH_FIELDS indexing a post or a comment by the
+    result of search.terms()."""
+    return [(term, post_id, comment_id, count * weight)
+            for term, count in terms.items()]
@@ -0,0 +1,126 @@
+import datetime
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from core.routers import use_primary
+
+from . import images
+from .models import Post
+
+CARD_TEMPLATE = 'includes/article.html'
+# query parameters selecting the page of a feed
+PAGE_PARAMS = ('after', 'before', 'page')
+
+
+def card_key(post, is_profile):
+    # post.updated is the version of the card: any save of the post
+    # moves it, so stale cards are never read and simply expire
+    variant = 'profile' if is_profile else 'feed'
+    version = post.updated.strftime('%Y%m%d%H%M%S%f')
+    return f'post_card:{post.pk}:{version}:{variant}'
+
+
+def render_cards(posts, is_profile=False):
+    """Render post cards, taking the cached ones with a single get_many."""
+    keys = [card_key(post, is_profile) for post in posts]
+    cards = cache.get_many(keys)
+    missing = {}
+    sources = images.sources(
+        [post for key, post in zip(keys, posts) if key not in cards])
+    for key, post in zip(keys, posts):
+        if key not in cards:
+            missing[key] = render_to_string(CARD_TEMPLATE, {
+                'post': post, 'is_profile': is_profile,
+                'sources': sources.get(post.pk, ())})
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_CACHE_TIMEOUT)
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
+
+
+def expire_author_cards(author):
+    """Drop cached cards of every post of author.
+
+    The card shows the name of the author, so it is versioned
+    by the posts, not by the user row.
+    """
+    Post.objects.filter(author=author).update(updated=timezone.now())
+
+
+def _version_key(parts):
+    return 'feed_version:' + ':'.join(str(part) for part in parts)
+
+
+def _new_version():
+    # the time of the change, then a random part
+    return f'{time.time_ns() // 1000}-{uuid4().hex}'
+
+
+def feed_versions(*feeds):
+    """Current versions of feeds, e.g. ('group', 1), by a single get_many.
+
+    Versions are random tokens rather than counters: a version
+    evicted from the cache is replaced by a new one and never
+    matches fragments rendered before the eviction.
+    """
+    keys = {_version_key(parts): parts for parts in feeds}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        version = _new_version()
+        if not cache.add(key, version, settings.FEED_VERSION_TIMEOUT):
+            version = cache.get(key, version)
+        versions[key] = version
+    return {parts: versions[key] for key, parts in keys.items()}
+
+
+def feed_version(*parts):
+    """Current version of the feed named by parts."""
+    return feed_versions(parts)[parts]
+
+
+def version_time(version):
+    """When the feed got version: the time of its last change, or a
+    later moment if the version was evicted from the cache since."""
+    micros, _, _ = version.partition('-')
+    if not micros.isdigit():
+        return None
+    return datetime.datetime.fromtimestamp(
+        int(micros) / 10 ** 6, tz=datetime.timezone.utc)
+
+
+def touch_feeds(*feeds):
+    """Expire the cached fragments of every feed in feeds."""
+    cache.set_many(
+        {_version_key(parts): _new_version() for parts in feeds},
+        settings.FEED_VERSION_TIMEOUT)
+
+
+def feed_context(request, *parts):
+    """Context variables of the shared, cacheable part of a feed page."""
+    page = [f'{param}={request.GET[param]}'
+            for param in PAGE_PARAMS if param in request.GET]
+    version = feed_version(*parts)
+    changed = version_time(version)
+    if changed and time.time() - changed.timestamp() < settings.REPLICA_LAG:
+        # a replica may miss the change yet, and the fragment read
+        # from it would be cached under the new version
+        use_primary()
+    return {
+        'feed_key': ':'.join([*map(str, parts), version, *page]),
+        'feed_timeout': settings.FEED_CACHE_TIMEOUT,
+    }
+
+
+def touch_post_feeds(post, old_group_id=None):
+    """Expire the cached feeds showing post."""
+    feeds = [('index',), ('profile', post.author_id)]
+    for group_id in {post.group_id, old_group_id}:
+        if group_id is not None:
+            feeds.append(('group', group_id))
+    touch_feeds(*feeds)
@@ -0,0 +1,78 @@
+"""Conditional GET for the post pages and the JSON API.
+
+A view decorated with conditional(validators) answers 304 Not Modified
+when the client already has the current response. validators(request,
+**kwargs) returns the parts of the ETag and the Last-Modified moment;
+it is called once per request and is expected to be cheap: feed
+versions from the cache or a single query.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.views.decorators.http import condition
+
+from .cache import feed_versions, version_time
+from .models import Comment
+
+# query parameters changing the body of a response
+VARY_PARAMS = ('after', 'before', 'page', 'fields', 'comments_after', 'q')
+
+
+def viewer(request):
+    """ETag parts of the pages rendered for the current user: the
+    header, the follow button and the CSRF token differ per user."""
+    return [f'user={request.user.pk or 0}:{request.user.get_username()}',
+            f'csrf={request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")}']
+
+
+def latest(*moments):
+    moments = [moment for moment in moments if moment is not None]
+    return max(moments) if moments else None
+
+
+def conditional(validators):
+    def state(request, **kwargs):
+        if not hasattr(request, '_validators'):
+            request._validators = validators(request, **kwargs)
+        return request._validators
+
+    def etag(request, **kwargs):
+        parts, _ = state(request, **kwargs)
+        if parts is None:
+            return None
+        params = [f'{param}={request.GET[param]}'
+                  for param in VARY_PARAMS if param in request.GET]
+        raw = '|'.join([request.path, *map(str, parts), *params])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def last_modified(request, **kwargs):
+        return state(request, **kwargs)[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def feed_state(*feeds):
+    """Validators of a page showing feeds: their versions and the
+    moment of the last change among them."""
+    versions = list(feed_versions(*feeds).values())
+    return versions, latest(*map(version_time, versions))
+
+
+def with_last_comment(posts):
+    """Annotate posts with the moment their comments last changed."""
+    last = Comment.objects.filter(post=OuterRef('pk')).order_by('-updated')
+    return posts.annotate(last_comment=Subquery(last.values('updated')[:1]))
+
+
+def post_state(post):
+    """Validators of a post page: the post annotated by
+    with_last_comment(), its author and the group shown beside it."""
+    feeds = [('profile', post.author_id)]
+    if post.group_id is not None:
+        feeds.append(('group', post.group_id))
+    versions, changed = feed_state(*feeds)
+    parts = [post.updated.isoformat(), post.comment_count,
+             post.last_comment and post.last_comment.isoformat(),
+             *versions]
+    return parts, latest(post.updated, post.last_comment, changed)
@@ -0,0 +1,58 @@
+"""Denormalized counters of users and posts.
+
+Counters are changed with F() expressions by the signal handlers
+in posts/signals.py, so concurrent writes don't lose updates; the
+views making the writes run in a transaction together with them.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Follow, Post, UserStats
+
+
+def _counted(queryset, field, delta):
+    # counters never go below zero, even if rows were
+    # written around the signals, e.g. by bulk_create
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def change_user_counter(user_id, field, delta):
+    updated = _counted(
+        UserStats.objects.filter(user_id=user_id), field, delta)
+    if not updated and delta > 0:
+        # users that have no counters yet get them on demand;
+        # not on deletes, the user may be being deleted itself
+        recount_user(user_id)
+
+
+def change_comment_count(post_id, delta):
+    _counted(Post.objects.filter(pk=post_id), 'comment_count', delta)
+
+
+def recount_user(user_id):
+    UserStats.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'post_count': Post.objects.filter(author_id=user_id).count(),
+            'follower_count': Follow.objects.filter(
+                author_id=user_id).count(),
+            'following_count': Follow.objects.filter(
+                user_id=user_id).count(),
+        })
+
+
+def _count_of(queryset, field):
+    counted = queryset.filter(**{field: OuterRef('user_id')}).order_by()
+    counted = counted.values(field).annotate(total=Count('id'))
+    return Coalesce(Subquery(counted.values('total')), 0)
+
+
+def recount_all():
+    """Recount the counters of every user, e.g. after bulk writes."""
+    UserStats.objects.update(
+        post_count=_count_of(Post.objects, 'author_id'),
+        follower_count=_count_of(Follow.objects, 'author_id'),
+        following_count=_count_of(Follow.objects, 'user_id'),
+    )
@@ -0,0 +1,34 @@
+"""Cached follow graph: the ids of the authors every user follows.
+
+The set is read from the cache, so "does the user follow the author"
+checks made on every page are lookups in memory instead of queries.
+Follow writes drop the set of the follower, see posts/signals.py.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Follow
+
+
+def followed_key(user_id):
+    return f'follows:{user_id}'
+
+
+def followed_authors(user_id):
+    """Frozen set of the ids of the authors user_id follows."""
+    key = followed_key(user_id)
+    authors = cache.get(key)
+    if authors is None:
+        authors = frozenset(Follow.objects.filter(
+            user_id=user_id).values_list('author_id', flat=True))
+        cache.set(key, authors, settings.FOLLOW_GRAPH_CACHE_TIMEOUT)
+    return authors
+
+
+def forget_followed(user_id):
+    key = followed_key(user_id)
+    cache.delete(key)
+    # a request reading the old set before the commit
+    # could have put it back into the cache
+    transaction.on_commit(lambda: cache.delete(key))
@@ -1,6 +1,8 @@
 
+from django.core.exceptions import ValidationError
 from django.forms import ModelForm
 from .models import Post, Comment
+from .uploads import RejectedUpload, check_image
 
 
 class PostForm(ModelForm):
@@ -9,6 +11,25 @@ class PostForm(ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        # a new upload, not the stored file or its clearing
+        if hasattr(image, 'image'):
+            check_image(image)
+        return image
+
+    def clean(self):
+        image = self.files.get(self.add_prefix('image'))
+        if isinstance(image, RejectedUpload):
+            # ImageField finds the empty stand-in of the file invalid,
+            # the error to show is its size
+            self.errors.pop('image', None)
+            try:
+                check_image(image)
+            except ValidationError as error:
+                self.add_error('image', error)
+        return super().clean()
+
 
 class CommentForm(ModelForm):
 
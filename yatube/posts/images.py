@@ -0,0 +1,111 @@
+"""Responsive variants of post images.
+
+The card crop of an uploaded image is encoded in every width of
+IMAGE_VARIANT_WIDTHS and every format of IMAGE_VARIANT_FORMATS that
+Pillow can write here, so a browser picks the smallest file it can
+show from the srcset. The variants carry no EXIF: the image is turned
+by its orientation tag before the tag is dropped.
+"""
+import os
+from collections import defaultdict
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .models import ImageVariant, Post
+
+# the size of the post cards, see includes/article.html
+CARD_WIDTH, CARD_HEIGHT = 960, 339
+VARIANTS_DIR = 'posts/variants/'
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp',
+              'jpeg': 'image/jpeg'}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+# the EXIF tag of the orientation and its values turning the image
+# by 90 degrees either way
+ORIENTATION = 0x0112
+TURNED = {5, 6, 7, 8}
+SAVE_OPTIONS = {'jpeg': {'optimize': True, 'progressive': True},
+                'webp': {'method': 6}}
+
+
+def formats():
+    """IMAGE_VARIANT_FORMATS this Pillow can write, the best first."""
+    Image.init()
+    return [name for name in settings.IMAGE_VARIANT_FORMATS
+            if name.upper() in Image.SAVE]
+
+
+def widths(image_width):
+    # an image is not upscaled beyond the smallest width
+    return ([width for width in settings.IMAGE_VARIANT_WIDTHS
+             if width <= image_width]
+            or [min(settings.IMAGE_VARIANT_WIDTHS)])
+
+
+def encode(file):
+    """Encode the card crop of an image file, yield
+    (format, width, height, bytes) of every variant."""
+    largest = max(settings.IMAGE_VARIANT_WIDTHS)
+    with Image.open(file) as original:
+        # a JPEG is decoded right at a fraction of its size, as long
+        # as the side that ends up the width stays above the largest one
+        turned = original.getexif().get(ORIENTATION) in TURNED
+        original.draft('RGB', (1, largest) if turned else (largest, 1))
+        image = ImageOps.exif_transpose(original)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    for width in widths(image.width):
+        size = (width, round(width * CARD_HEIGHT / CARD_WIDTH))
+        resized = ImageOps.fit(image, size, Image.LANCZOS)
+        for name in formats():
+            data = BytesIO()
+            resized.save(data, name.upper(),
+                         quality=settings.IMAGE_VARIANT_QUALITY[name],
+                         **SAVE_OPTIONS.get(name, {}))
+            yield name, size[0], size[1], data.getvalue()
+
+
+def build_variants(post):
+    """Save the variants of post.image to its storage and return the
+    unsaved ImageVariant rows describing them."""
+    storage = post.image.storage
+    stem = os.path.splitext(os.path.basename(post.image.name))[0]
+    variants = []
+    with post.image.open('rb') as file:
+        for name, width, height, data in encode(file):
+            path = f'{VARIANTS_DIR}{stem}_{width}.{EXTENSIONS[name]}'
+            variants.append(ImageVariant(
+                post=post, format=name, width=width, height=height,
+                name=storage.save(path, ContentFile(data))))
+    return variants
+
+
+def drop_variants(post):
+    """Delete the variants of the previous image of post, their files
+    go with the last reference, see posts/media.py."""
+    post.image_variants.all().delete()
+
+
+def sources(posts):
+    """The <source> elements of the pictures of posts by a single
+    query: {post id: [(mime type, srcset)]}, the best format first."""
+    ids = [post.pk for post in posts if post.thumbnail]
+    if not ids:
+        return {}
+    storage = Post._meta.get_field('image').storage
+    srcsets = defaultdict(lambda: defaultdict(list))
+    for variant in ImageVariant.objects.filter(
+            post_id__in=ids).order_by('width'):
+        srcsets[variant.post_id][variant.format].append(
+            f'{storage.url(variant.name)} {variant.width}w')
+    order = {name: number for number, name in
+             enumerate(settings.IMAGE_VARIANT_FORMATS)}
+    return {
+        post_id: [(MIME_TYPES[name], ', '.join(srcset))
+                  for name, srcset in sorted(
+                      by_format.items(),
+                      key=lambda item: order.get(item[0], len(order)))]
+        for post_id, by_format in srcsets.items()
+    }
@@ -0,0 +1,126 @@
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from io import BytesIO
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from PIL import Image
+
+from posts import images
+from posts.forms import PostForm
+
+DEFAULT_MEGAPIXELS = '1,4,12,24,48'
+
+
+def _peak_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(path, length):
+    """Parse and validate the upload in path, then encode its variants,
+    in a process of its own: the peak memory of a process only grows."""
+    result = {}
+    before = _peak_mb()
+    start = time.perf_counter()
+    with open(path, 'rb') as body:
+        request = WSGIRequest({
+            'REQUEST_METHOD': 'POST', 'PATH_INFO': '/create/',
+            'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+            'wsgi.input': body, 'wsgi.url_scheme': 'http',
+            'CONTENT_TYPE': MULTIPART_CONTENT,
+            'CONTENT_LENGTH': str(length),
+        })
+        form = PostForm(request.POST, request.FILES)
+        valid = form.is_valid()
+    result['validate_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    result['validate_mb'] = round(_peak_mb() - before, 1)
+    if not valid:
+        result['error'] = ' '.join(form.errors.get('image', ['invalid']))
+        return result
+
+    start = time.perf_counter()
+    image = form.cleaned_data['image']
+    image.seek(0)
+    result['variants'] = sum(1 for _ in images.encode(image))
+    result['variants_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    result['variants_mb'] = round(_peak_mb() - before, 1)
+    return result
+
+
+def _write_upload(path, megapixels):
+    """Write the body of a form upload of a JPEG of megapixels with
+    the aspect and, thanks to the noise, roughly the weight of a photo;
+    return the size of the image."""
+    width = int((megapixels * 10 ** 6 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    size = (width, height)
+    image = Image.merge('RGB', [
+        Image.blend(Image.radial_gradient('L').resize(size),
+                    Image.effect_noise(size, 40), 0.3)] * 3)
+    file = BytesIO()
+    file.name = 'bench.jpg'
+    image.save(file, 'JPEG', quality=90)
+    file.seek(0)
+    with open(path, 'wb') as body:
+        body.write(encode_multipart(BOUNDARY, {
+            'text': 'Замер памяти', 'image': file}))
+    return f'{width}x{height}'
+
+
+class Command(BaseCommand):
+    help = ('Измеряет пиковую память и время загрузки картинки поста '
+            'и построения её вариантов для картинок разного размера')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--megapixels', default=DEFAULT_MEGAPIXELS,
+            help='размеры картинок в мегапикселях через запятую')
+        parser.add_argument(
+            '--json', action='store_true', help='вывести отчёт в JSON')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [float(size) for size in options['megapixels'].split(',')]
+        except ValueError:
+            raise CommandError('Размеры — числа через запятую')
+        results = []
+        context = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'body')
+            for megapixels in sizes:
+                # every step runs in a fresh process, so the memory
+                # freed by one isn't reused unmeasured by the next
+                with context.Pool(1) as pool:
+                    size = pool.apply(_write_upload, (path, megapixels))
+                with context.Pool(1) as pool:
+                    result = pool.apply(
+                        _measure, (path, os.path.getsize(path)))
+                results.append({
+                    'megapixels': megapixels,
+                    'size': size,
+                    'file_mb': round(os.path.getsize(path) / 2 ** 20, 2),
+                    **result})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2,
+                                         ensure_ascii=False))
+        else:
+            self.print_report(results)
+
+    def print_report(self, results):
+        columns = ('size', 'file_mb', 'validate_ms', 'validate_mb',
+                   'variants_ms', 'variants_mb')
+        self.stdout.write(f'{"megapixels":<12}' + ''.join(
+            f'{column:>13}' for column in columns))
+        for result in results:
+            self.stdout.write(
+                f'{result["megapixels"]:<12}'
+                + ''.join(f'{str(result.get(column, "-")):>13}'
+                          for column in columns)
+                + (f'  {result["error"]}' if 'error' in result else ''))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры картинок постов, у которых их ещё нет'
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').filter(
+            thumbnail='').values_list('id', flat=True)
+        built = 0
+        for post_id in posts.iterator():
+            thumbnails.build(post_id)
+            built += 1
+        self.stdout.write(f'Обработано постов: {built}')
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Comment, Follow, Post
+from posts.timeline import TimelinePaginator, follow_feed
+from posts.utils import COMMENTS_ORDERING, KeysetPaginator
+
+
+class Command(BaseCommand):
+    help = 'Печатает планы запросов лент, чтобы проверить работу индексов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--deep', action='store_true',
+            help='объяснять запрос дальней страницы ленты (с курсором)')
+
+    def handle(self, *args, **options):
+        post = Post.objects.order_by('-pub_date', '-id').first()
+        if post is None:
+            self.stderr.write('В базе нет постов, объяснять нечего.')
+            return
+        follow = Follow.objects.select_related('user').first()
+        key = [post.pub_date, post.id]
+
+        feeds = {
+            'index': Post.objects.all(),
+            'group_posts': Post.objects.filter(group_id=post.group_id),
+            'profile': Post.objects.filter(author_id=post.author_id),
+        }
+        for name, queryset in feeds.items():
+            self.explain(name, KeysetPaginator(queryset, 10), key, options)
+        if follow is not None:
+            # the pages are read from the timeline and the posts
+            # of the pulled authors, then the posts by their ids
+            timeline = TimelinePaginator(
+                follow_feed(follow.user), 10, user=follow.user)
+            for queryset, ordering in timeline.streams():
+                self.explain(
+                    f'follow_index: {queryset.model._meta.db_table}',
+                    KeysetPaginator(queryset, 10, ordering), key, options)
+
+        comment = Comment.objects.filter(post_id=post.pk).first()
+        comments = KeysetPaginator(
+            Comment.objects.filter(post_id=post.pk), 20, COMMENTS_ORDERING)
+        self.explain('post_detail comments', comments,
+                     comment and comments.key_of(comment), options)
+
+    def explain(self, name, paginator, key, options):
+        queryset = paginator.object_list
+        if options['deep'] and key is not None:
+            queryset = queryset.filter(
+                paginator._seek(key, backwards=False))
+        queryset = queryset[:paginator.per_page + 1]
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(str(queryset.query))
+        self.stdout.write(queryset.explain())
+        self.stdout.write('')
@@ -0,0 +1,93 @@
+import gzip
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts.utils import CursorEncoder
+
+CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = ('Выгружает группы, авторов, посты с комментариями и подписки '
+            'в NDJSON, не загружая их в память')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output', nargs='?', default='-',
+            help='файл для выгрузки, .gz сжимается; по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if output == '-':
+            self.export(sys.stdout)
+        elif output.endswith('.gz'):
+            with gzip.open(output, 'wt', encoding='utf-8') as out:
+                self.export(out)
+        else:
+            with open(output, 'w', encoding='utf-8') as out:
+                self.export(out)
+
+    def export(self, out):
+        start = time.monotonic()
+        written = 0
+        for record in self.records():
+            out.write(json.dumps(record, cls=CursorEncoder,
+                                 ensure_ascii=False))
+            out.write('\n')
+            written += 1
+            if written % 10000 == 0:
+                self.progress(written, start)
+        self.progress(written, start)
+
+    def progress(self, written, start):
+        elapsed = time.monotonic() - start
+        self.stderr.write(
+            f'Выгружено записей: {written}, '
+            f'{written / elapsed if elapsed else 0:.0f} в секунду')
+
+    def records(self):
+        groups = Group.objects.order_by('id').values_list(
+            'slug', 'title', 'description')
+        for slug, title, description in groups.iterator(CHUNK_SIZE):
+            yield {'type': 'group', 'slug': slug, 'title': title,
+                   'description': description}
+
+        users = User.objects.order_by('id').values_list(
+            'username', 'first_name', 'last_name')
+        for username, first_name, last_name in users.iterator(CHUNK_SIZE):
+            yield {'type': 'user', 'username': username,
+                   'first_name': first_name, 'last_name': last_name}
+
+        yield from self.posts()
+
+        follows = Follow.objects.order_by('id').values_list(
+            'user__username', 'author__username')
+        for user, author in follows.iterator(CHUNK_SIZE):
+            yield {'type': 'follow', 'user': user, 'author': author}
+
+    def posts(self):
+        # posts and comments are read by two streams ordered by post
+        # and merged, so every post line carries its own comments
+        posts = Post.objects.order_by('id').values_list(
+            'id', 'author__username', 'group__slug', 'text', 'pub_date',
+            'image')
+        comments = Comment.objects.order_by('post_id', 'id').values_list(
+            'post_id', 'author__username', 'text', 'created')
+        comments = comments.iterator(CHUNK_SIZE)
+        comment = next(comments, None)
+        for post_id, author, group, text, pub_date, image in posts.iterator(
+                CHUNK_SIZE):
+            post_comments = []
+            while comment is not None and comment[0] <= post_id:
+                if comment[0] == post_id:
+                    post_comments.append({'author': comment[1],
+                                          'text': comment[2],
+                                          'created': comment[3]})
+                comment = next(comments, None)
+            yield {'type': 'post', 'author': author, 'group': group,
+                   'text': text, 'pub_date': pub_date, 'image': image,
+                   'comments': post_comments}
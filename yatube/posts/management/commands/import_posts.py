@@ -0,0 +1,195 @@
+import gzip
+import json
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from posts import counters, media, search, timeline
+from posts.bulk import (SEARCH_FIELDS, insert_rows, keep_dates, next_id,
+                        reset_sequences, search_entries)
+from posts.cache import touch_feeds
+from posts.follows import forget_followed
+from posts.models import (Comment, Follow, Group, Post, SearchEntry, User,
+                          UserStats)
+
+
+class Command(BaseCommand):
+    help = ('Загружает NDJSON, выгруженный export_posts, пачками '
+            'через bulk_create')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input', nargs='?', default='-',
+            help='файл выгрузки, .gz распаковывается; по умолчанию stdin')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='записей в одной транзакции')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.imported = Counter()
+        self.start = time.monotonic()
+        source = options['input']
+        if source == '-':
+            self.load(sys.stdin)
+        elif source.endswith('.gz'):
+            with gzip.open(source, 'rt', encoding='utf-8') as lines:
+                self.load(lines)
+        else:
+            with open(source, encoding='utf-8') as lines:
+                self.load(lines)
+
+        # bulk_create skips the signals keeping the counters
+        counters.recount_all()
+        timeline.sync_pulled()
+        media.recount()
+        reset_sequences(Post, Comment)
+        self.progress()
+        self.stdout.write(
+            'Готово. Миниатюры картинок строит manage.py build_thumbnails')
+
+    def load(self, lines):
+        kind, batch = None, []
+        with keep_dates():
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as error:
+                    raise CommandError(f'Строка {number}: {error}')
+                full = len(batch) >= self.batch_size
+                if record.get('type') != kind or full:
+                    self.flush(kind, batch)
+                    kind, batch = record.get('type'), []
+                batch.append(record)
+            self.flush(kind, batch)
+
+    def flush(self, kind, batch):
+        if not batch:
+            return
+        importer = getattr(self, f'import_{kind}s', None)
+        if importer is None:
+            raise CommandError(f'Неизвестный тип записи: {kind}')
+        with transaction.atomic():
+            importer(batch)
+        total = sum(self.imported.values())
+        self.imported[kind] += len(batch)
+        if total // 10000 != sum(self.imported.values()) // 10000:
+            self.progress()
+
+    def progress(self):
+        total = sum(self.imported.values())
+        elapsed = time.monotonic() - self.start
+        counts = ', '.join(f'{kind}: {count}'
+                           for kind, count in self.imported.items())
+        self.stderr.write(
+            f'Загружено записей: {total} ({counts}), '
+            f'{total / elapsed if elapsed else 0:.0f} в секунду')
+
+    def user_ids(self, usernames, records=None):
+        """Ids of usernames, creating the users that are missing."""
+        usernames = set(usernames)
+        ids = dict(User.objects.filter(
+            username__in=usernames).values_list('username', 'id'))
+        missing = usernames - ids.keys()
+        if missing:
+            records = records or {}
+            # imported users sign in after resetting the password
+            password = make_password(None)
+            users = []
+            for username in missing:
+                record = records.get(username, {})
+                users.append(User(
+                    username=username, password=password,
+                    first_name=record.get('first_name', ''),
+                    last_name=record.get('last_name', '')))
+            User.objects.bulk_create(users)
+            created = dict(User.objects.filter(
+                username__in=missing).values_list('username', 'id'))
+            UserStats.objects.bulk_create(
+                (UserStats(user_id=user_id) for user_id in created.values()),
+                ignore_conflicts=True)
+            ids.update(created)
+        return ids
+
+    def group_ids(self, slugs):
+        slugs = set(slugs) - {None}
+        Group.objects.bulk_create(
+            (Group(slug=slug, title=slug, description='') for slug in slugs),
+            ignore_conflicts=True)
+        return dict(Group.objects.filter(
+            slug__in=slugs).values_list('slug', 'id'))
+
+    def import_groups(self, batch):
+        Group.objects.bulk_create(
+            (Group(slug=record['slug'], title=record['title'],
+                   description=record['description']) for record in batch),
+            ignore_conflicts=True)
+
+    def import_users(self, batch):
+        self.user_ids((record['username'] for record in batch),
+                      {record['username']: record for record in batch})
+
+    def import_posts(self, batch):
+        authors = self.user_ids(
+            name for record in batch
+            for name in [record['author']] + [
+                comment['author'] for comment in record['comments']])
+        groups = self.group_ids(record['group'] for record in batch)
+
+        post_id, comment_id = next_id(Post), next_id(Comment)
+        posts, comments, entries = [], [], []
+        for record in batch:
+            post = Post(
+                id=post_id, author_id=authors[record['author']],
+                group_id=groups.get(record['group']), text=record['text'],
+                pub_date=parse_datetime(record['pub_date']),
+                image=record['image'] or '',
+                comment_count=len(record['comments']))
+            posts.append(post)
+            entries.extend(search_entries(
+                post_id, None, search.terms(post.text), search.POST_WEIGHT))
+            for comment in record['comments']:
+                comments.append(Comment(
+                    id=comment_id, post_id=post_id,
+                    author_id=authors[comment['author']],
+                    text=comment['text'],
+                    created=parse_datetime(comment['created'])))
+                entries.extend(search_entries(
+                    post_id, comment_id, search.terms(comment['text']),
+                    search.COMMENT_WEIGHT))
+                comment_id += 1
+            post_id += 1
+
+        Post.objects.bulk_create(posts)
+        Comment.objects.bulk_create(comments)
+        insert_rows(SearchEntry, SEARCH_FIELDS, entries)
+        if settings.TIMELINE_ENABLED:
+            timeline.fan_out_many(posts)
+        touch_feeds(('index',),
+                    *(('group', group_id) for group_id in groups.values()),
+                    *(('profile', post.author_id) for post in posts))
+
+    def import_follows(self, batch):
+        users = self.user_ids(
+            name for record in batch
+            for name in (record['user'], record['author']))
+        pairs = {(users[record['user']], users[record['author']])
+                 for record in batch}
+        Follow.objects.bulk_create(
+            (Follow(user_id=user_id, author_id=author_id)
+             for user_id, author_id in pairs),
+            ignore_conflicts=True)
+        for user_id, author_id in pairs:
+            if settings.TIMELINE_ENABLED:
+                timeline.backfill(user_id, author_id)
+            forget_followed(user_id)
+        touch_feeds(*{('profile', user_id)
+                      for pair in pairs for user_id in pair})
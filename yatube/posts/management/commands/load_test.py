@@ -0,0 +1,208 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from core.profiling import percentile
+from posts.models import Post, UserStats
+
+VIEWS = ('index', 'post_detail', 'profile', 'follow_index')
+DEFAULT_MIX = 'index=40,post_detail=30,profile=20,follow_index=10'
+PERCENTILES = (50, 95, 99)
+# how many posts, authors and readers the requests are spread over
+SAMPLE_SIZE = 500
+TIMEOUT = 30
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        view, _, weight = part.partition('=')
+        view = view.strip()
+        if view not in VIEWS:
+            raise CommandError(
+                f'Неизвестная страница {view}, есть: {", ".join(VIEWS)}')
+        try:
+            weights[view] = float(weight)
+        except ValueError:
+            raise CommandError(f'Неверный вес страницы {view}: {weight}')
+    if not any(weight > 0 for weight in weights.values()):
+        raise CommandError('Все веса нулевые')
+    return weights
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенный сервер запросами к ленте, постам, '
+            'профилям и подпискам и выводит перцентили времени ответа')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000',
+            help='адрес сервера, например manage.py runserver')
+        parser.add_argument(
+            '--duration', type=float, default=30,
+            help='длительность в секундах')
+        parser.add_argument(
+            '--requests', type=int,
+            help='остановиться после стольких запросов')
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='число одновременных клиентов')
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help='доли страниц в запросах')
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='префикс пользователей seed_load, входящих на сайт')
+        parser.add_argument(
+            '--password', default='seed-password',
+            help='их пароль, нужен для follow_index')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--json', action='store_true', help='вывести отчёт в JSON')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.base = options['url'].rstrip('/')
+        self.mix = parse_mix(options['mix'])
+        self.targets()
+        sessions = [self.session(number)
+                    for number in range(options['concurrency'])]
+
+        self.results = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        self.left = options['requests']
+        self.deadline = time.monotonic() + options['duration']
+        start = time.monotonic()
+        workers = [threading.Thread(target=self.work, args=(session, seed))
+                   for seed, session in enumerate(sessions)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        report = self.report(time.monotonic() - start)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    def targets(self):
+        posts = Post.objects.values_list('id', flat=True)
+        self.posts = list(posts.order_by('-pub_date')[:SAMPLE_SIZE])
+        # the profiles of popular authors are opened the most
+        authors = UserStats.objects.filter(post_count__gt=0).order_by(
+            '-follower_count').values_list('user__username', flat=True)
+        self.authors = list(authors[:SAMPLE_SIZE])
+        readers = UserStats.objects.filter(
+            following_count__gt=0,
+            user__username__startswith=f'{self.options["prefix"]}_',
+        ).values_list('user__username', flat=True)
+        self.readers = list(readers[:SAMPLE_SIZE])
+        if not self.posts:
+            raise CommandError('В базе нет постов, запустите seed_load')
+        if self.mix.get('follow_index') and not self.readers:
+            raise CommandError(
+                f'Нет пользователей с префиксом {self.options["prefix"]} '
+                f'и подписками для follow_index')
+
+    def session(self, number):
+        """A client; signed in as a reader when the mix has
+        follow_index."""
+        session = requests.Session()
+        if not self.mix.get('follow_index'):
+            return session
+        login = self.base + reverse('users:login')
+        try:
+            session.get(login, timeout=TIMEOUT)
+            response = session.post(login, timeout=TIMEOUT, data={
+                'username': self.readers[number % len(self.readers)],
+                'password': self.options['password'],
+                'csrfmiddlewaretoken': session.cookies.get('csrftoken'),
+            }, headers={'Referer': login})
+        except requests.RequestException as error:
+            raise CommandError(f'Сервер {self.base} не отвечает: {error}')
+        if response.status_code >= 400 or 'sessionid' not in session.cookies:
+            raise CommandError(
+                'Не удалось войти, проверьте --password и --prefix')
+        return session
+
+    def path(self, view, rnd):
+        if view == 'index':
+            return reverse('posts:index')
+        if view == 'post_detail':
+            return reverse('posts:post_detail', args=[rnd.choice(self.posts)])
+        if view == 'profile':
+            return reverse('posts:profile', args=[rnd.choice(self.authors)])
+        return reverse('posts:follow_index')
+
+    def take(self):
+        """Whether one more request is to be made."""
+        if time.monotonic() >= self.deadline:
+            return False
+        if self.left is None:
+            return True
+        with self.lock:
+            self.left -= 1
+            return self.left >= 0
+
+    def work(self, session, seed):
+        rnd = random.Random(self.options['seed'] * 1000 + seed)
+        views, weights = zip(*self.mix.items())
+        while self.take():
+            view = rnd.choices(views, weights)[0]
+            url = self.base + self.path(view, rnd)
+            start = time.perf_counter()
+            try:
+                failed = session.get(url, timeout=TIMEOUT).status_code >= 400
+            except requests.RequestException:
+                failed = True
+            elapsed = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.results[view].append(elapsed)
+                self.errors[view] += failed
+
+    def report(self, elapsed):
+        views = []
+        for view in VIEWS:
+            times = sorted(self.results.get(view, []))
+            if not times:
+                continue
+            row = {'view': view, 'requests': len(times),
+                   'errors': self.errors[view],
+                   'mean_ms': round(sum(times) / len(times), 2)}
+            for percent in PERCENTILES:
+                row[f'p{percent}_ms'] = round(percentile(times, percent), 2)
+            views.append(row)
+        times = sorted(value for view_times in self.results.values()
+                       for value in view_times)
+        total = {'requests': len(times),
+                 'errors': sum(self.errors.values()),
+                 'seconds': round(elapsed, 2),
+                 'rps': round(len(times) / elapsed, 1) if elapsed else 0}
+        for percent in PERCENTILES:
+            value = percentile(times, percent)
+            total[f'p{percent}_ms'] = value and round(value, 2)
+        return {'url': self.base,
+                'concurrency': self.options['concurrency'],
+                'views': views, 'total': total}
+
+    def print_report(self, report):
+        columns = ['requests', 'errors', 'mean_ms',
+                   *(f'p{percent}_ms' for percent in PERCENTILES)]
+        self.stdout.write(f'{"view":<14}' + ''.join(
+            f'{column:>10}' for column in columns))
+        for row in report['views']:
+            self.stdout.write(f'{row["view"]:<14}' + ''.join(
+                f'{row[column]:>10}' for column in columns))
+        total = report['total']
+        self.stdout.write(
+            f'Всего {total["requests"]} запросов за {total["seconds"]} с, '
+            f'{total["rps"]} в секунду, ошибок: {total["errors"]}; '
+            + ', '.join(f'p{percent} {total[f"p{percent}_ms"]} мс'
+                        for percent in PERCENTILES))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from posts import media
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает ссылки на картинки постов и удаляет файлы, '
+            'на которые не ссылается ни один пост или вариант картинки')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='не трогать файлы моложе стольких секунд: '
+                 'их пост может сохраняться прямо сейчас')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='только показать, что будет удалено')
+
+    def handle(self, *args, **options):
+        directory = Post._meta.get_field('image').upload_to.rstrip('/')
+        count = size = 0
+        for name in media.orphans(directory, options['min_age'],
+                                  options['dry_run']):
+            count += 1
+            size += media.storage.size(name)
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                media.storage.delete(name)
+        action = 'Можно удалить' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            f'{action} файлов: {count}, {filesizeformat(size)}')
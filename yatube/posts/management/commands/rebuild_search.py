@@ -0,0 +1,41 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+from posts.bulk import SEARCH_FIELDS, insert_rows, search_entries
+from posts.models import Comment, Post, SearchEntry
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Заново строит поисковый индекс всех постов и комментариев: '
+            'после обновления базы без индекса или смены стеммера')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.values_list('id', 'text')
+        comments = Comment.objects.values_list('post_id', 'id', 'text')
+        with transaction.atomic():
+            SearchEntry.objects.all().delete()
+            indexed = self.index(
+                ((post_id, None, text)
+                 for post_id, text in posts.iterator()),
+                search.POST_WEIGHT)
+            indexed += self.index(comments.iterator(), search.COMMENT_WEIGHT)
+        self.stdout.write(f'Проиндексировано текстов: {indexed}')
+
+    def index(self, texts, weight):
+        """Index texts, (post_id, comment_id, text), batch by batch."""
+        indexed = 0
+        while True:
+            batch = list(islice(texts, BATCH_SIZE))
+            if not batch:
+                return indexed
+            entries = []
+            for post_id, comment_id, text in batch:
+                entries.extend(search_entries(
+                    post_id, comment_id, search.terms(text), weight))
+            insert_rows(SearchEntry, SEARCH_FIELDS, entries)
+            indexed += len(batch)
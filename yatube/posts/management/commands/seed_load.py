@@ -0,0 +1,266 @@
+import datetime
+import random
+import time
+from collections import Counter
+from io import BytesIO
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from faker import Faker
+from PIL import Image
+
+from posts import counters, media, search, timeline
+from posts.bulk import (SEARCH_FIELDS, insert_rows, keep_dates, next_id,
+                        reset_sequences, search_entries)
+from posts.cache import touch_feeds
+from posts.models import (Comment, Follow, Group, Post, SearchEntry, User,
+                          UserStats)
+
+# texts and names are put together from pools: Faker is
+# too slow to make every one of millions of rows
+POOL_SIZE = 1000
+IMAGE_COUNT = 20
+
+
+def power_law(items, alpha, rnd):
+    """Cumulative weights giving items, in random order, the shares
+    of a Zipf distribution: a few get most of the picks."""
+    weights = [1 / rank ** alpha for rank in range(1, len(items) + 1)]
+    rnd.shuffle(weights)
+    return list(accumulate(weights))
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, постами, '
+            'комментариями и подписками для нагрузочных тестов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--posts', type=int, default=100_000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument(
+            '--follows', type=float, default=20,
+            help='подписок на пользователя в среднем')
+        parser.add_argument(
+            '--comments', type=float, default=2,
+            help='комментариев к посту в среднем')
+        parser.add_argument(
+            '--images', type=float, default=0.1,
+            help='доля постов с картинкой')
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='показатель степенного распределения подписчиков '
+                 'и активности авторов')
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='за сколько дней распределены посты')
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='префикс имён пользователей и адресов групп')
+        parser.add_argument(
+            '--password', default='seed-password',
+            help='пароль всех созданных пользователей, для load_test')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--skip-search', action='store_true',
+            help='не строить поисковый индекс новых постов')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.prefix = options['prefix']
+        if User.objects.filter(
+                username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(
+                f'Пользователи с префиксом {self.prefix} уже есть, '
+                f'укажите другой --prefix')
+        if options['users'] < 2:
+            raise CommandError('Нужно хотя бы два пользователя')
+        self.batch_size = options['batch_size']
+        self.rnd = random.Random(options['seed'])
+        fake = Faker('ru_RU')
+        fake.seed_instance(options['seed'])
+        self.sentences = [fake.sentence() for _ in range(POOL_SIZE)]
+        # texts are made of whole sentences, so their search terms
+        # are the sums of the terms of the sentences
+        self.terms = [search.terms(sentence) for sentence in self.sentences]
+        self.names = [(fake.first_name(), fake.last_name())
+                      for _ in range(POOL_SIZE)]
+        self.words = [fake.word() for _ in range(POOL_SIZE)]
+        self.written = Counter()
+        self.start = time.monotonic()
+
+        with keep_dates():
+            users = self.seed_users()
+            groups = self.seed_groups()
+            self.seed_follows(users)
+            # the authors with many followers are pulled into feeds
+            # on read, so they are known before the posts are fanned out
+            counters.recount_all()
+            timeline.sync_pulled()
+            self.seed_posts(users, groups, self.seed_images())
+        counters.recount_all()
+        media.recount()
+        reset_sequences(User, Group, Post, Comment)
+        touch_feeds(('index',), *(('group', group) for group in groups))
+        self.progress()
+        self.stdout.write(
+            'Готово. Миниатюры картинок строит manage.py build_thumbnails')
+
+    def progress(self):
+        total = sum(self.written.values())
+        elapsed = time.monotonic() - self.start
+        counts = ', '.join(f'{kind}: {count}'
+                           for kind, count in self.written.items())
+        self.stderr.write(
+            f'Записано строк: {total} ({counts}), '
+            f'{total / elapsed if elapsed else 0:.0f} в секунду')
+
+    def batches(self, rows):
+        """Split rows into lists of batch_size."""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def seed_users(self):
+        password = make_password(self.options['password'])
+        first_id = next_id(User)
+        ids = range(first_id, first_id + self.options['users'])
+        for batch in self.batches(ids):
+            users = []
+            for user_id in batch:
+                first_name, last_name = self.rnd.choice(self.names)
+                users.append(User(
+                    id=user_id, username=f'{self.prefix}_{user_id}',
+                    password=password, first_name=first_name,
+                    last_name=last_name))
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                UserStats.objects.bulk_create(
+                    UserStats(user_id=user_id) for user_id in batch)
+            self.written['user'] += len(batch)
+        self.progress()
+        return list(ids)
+
+    def seed_groups(self):
+        groups = []
+        for number in range(self.options['groups']):
+            word = self.rnd.choice(self.words)
+            groups.append(Group(
+                title=f'{word.capitalize()} {number}',
+                slug=f'{self.prefix}-{number}',
+                description=self.rnd.choice(self.sentences)))
+        Group.objects.bulk_create(groups)
+        self.written['group'] += len(groups)
+        return list(Group.objects.filter(
+            slug__startswith=f'{self.prefix}-').values_list('id', flat=True))
+
+    def seed_follows(self, users):
+        # every user follows about --follows authors picked by
+        # popularity, so followers are spread by a power law
+        popularity = power_law(users, self.options['alpha'], self.rnd)
+        mean = self.options['follows']
+        limit = len(users) - 1
+
+        def follows():
+            for user_id in users:
+                count = min(round(self.rnd.expovariate(1 / mean)), limit)
+                authors = set(self.rnd.choices(
+                    users, cum_weights=popularity, k=count))
+                authors.discard(user_id)
+                for author_id in authors:
+                    yield Follow(user_id=user_id, author_id=author_id)
+
+        if not mean:
+            return
+        for batch in self.batches(follows()):
+            with transaction.atomic():
+                Follow.objects.bulk_create(batch, ignore_conflicts=True)
+            self.written['follow'] += len(batch)
+        self.progress()
+
+    def seed_images(self):
+        names = []
+        for number in range(IMAGE_COUNT):
+            color = tuple(self.rnd.randrange(256) for _ in range(3))
+            content = BytesIO()
+            Image.new('RGB', (960, 640), color).save(content, 'JPEG')
+            names.append(media.storage.save(
+                f'posts/{self.prefix}_{number}.jpg',
+                ContentFile(content.getvalue())))
+        return names
+
+    def seed_posts(self, users, groups, images):
+        # authors write by a power law too, the newest posts get
+        # the largest ids like the ones written through the site
+        activity = power_law(users, self.options['alpha'], self.rnd)
+        now = timezone.now()
+        span = datetime.timedelta(days=self.options['days'])
+        total = self.options['posts']
+        groups = groups + [None]
+        post_id, comment_id = next_id(Post), next_id(Comment)
+        for batch in self.batches(range(total)):
+            authors = self.rnd.choices(users, cum_weights=activity,
+                                       k=len(batch))
+            posts, comments = [], []
+            for number, author_id in zip(batch, authors):
+                pub_date = now - span * (total - number) / total
+                post = self.make_post(post_id, author_id, pub_date,
+                                      self.rnd.choice(groups), images)
+                for _ in range(post.comment_count):
+                    created = min(now, pub_date + datetime.timedelta(
+                        minutes=self.rnd.randrange(1, 60 * 24)))
+                    sentence = self.rnd.randrange(POOL_SIZE)
+                    comment = Comment(
+                        id=comment_id, post_id=post_id,
+                        author_id=self.rnd.choice(users),
+                        text=self.sentences[sentence], created=created)
+                    comment.terms = self.terms[sentence]
+                    comments.append(comment)
+                    comment_id += 1
+                posts.append(post)
+                post_id += 1
+            with transaction.atomic():
+                self.write_posts(posts, comments)
+            self.progress()
+
+    def make_post(self, post_id, author_id, pub_date, group_id, images):
+        chosen = self.rnd.sample(range(POOL_SIZE), self.rnd.randint(1, 6))
+        image = ''
+        if images and self.rnd.random() < self.options['images']:
+            image = self.rnd.choice(images)
+        comments = self.options['comments']
+        count = round(self.rnd.expovariate(1 / comments)) if comments else 0
+        post = Post(id=post_id, author_id=author_id, group_id=group_id,
+                    text=' '.join(self.sentences[i] for i in chosen),
+                    pub_date=pub_date, image=image, comment_count=count)
+        post.terms = sum((self.terms[i] for i in chosen), Counter())
+        return post
+
+    def write_posts(self, posts, comments):
+        Post.objects.bulk_create(posts)
+        Comment.objects.bulk_create(comments)
+        self.written['post'] += len(posts)
+        self.written['comment'] += len(comments)
+        if not self.options['skip_search']:
+            entries = []
+            for post in posts:
+                entries.extend(search_entries(
+                    post.id, None, post.terms, search.POST_WEIGHT))
+            for comment in comments:
+                entries.extend(search_entries(
+                    comment.post_id, comment.id, comment.terms,
+                    search.COMMENT_WEIGHT))
+            insert_rows(SearchEntry, SEARCH_FIELDS, entries)
+        if settings.TIMELINE_ENABLED:
+            timeline.fan_out_many(posts)
@@ -0,0 +1,100 @@
+"""Reference counts of the files of HashedStorage.
+
+A file may be named by several posts and image variants at once, so
+it is deleted when the last of them goes, once the transaction
+dropping it commits. Counts are changed with F() expressions by the
+signal handlers in posts/signals.py and by posts/thumbnails.py;
+writes around them, e.g. by bulk_create, are fixed by recount().
+"""
+import os
+import time
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .models import ImageVariant, MediaFile, Post
+
+storage = Post._meta.get_field('image').storage
+
+
+def acquire(*names):
+    for name in filter(None, names):
+        updated = MediaFile.objects.filter(name=name).update(
+            refs=F('refs') + 1)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    MediaFile.objects.create(name=name, refs=1)
+            except IntegrityError:
+                # counted by a concurrent transaction meanwhile
+                MediaFile.objects.filter(name=name).update(
+                    refs=F('refs') + 1)
+
+
+def release(*names):
+    for name in filter(None, names):
+        MediaFile.objects.filter(name=name, refs__gt=0).update(
+            refs=F('refs') - 1)
+        if MediaFile.objects.filter(name=name, refs=0).delete()[0]:
+            discard(name)
+
+
+def discard(*names):
+    """Delete files no row names after the transaction commits."""
+    def delete():
+        for name in names:
+            # the file may have been saved again meanwhile
+            if MediaFile.objects.filter(name=name).exists():
+                continue
+            try:
+                storage.delete(name)
+            except SuspiciousFileOperation:
+                # a name outside the storage isn't ours to delete
+                pass
+    transaction.on_commit(delete)
+
+
+def references():
+    """{name: number of rows naming it} of every stored file."""
+    counts = {}
+    for queryset, field in ((Post.objects.exclude(image=''), 'image'),
+                            (ImageVariant.objects, 'name')):
+        for name, refs in queryset.order_by().values(field).annotate(
+                refs=Count('id')).values_list(field, 'refs'):
+            counts[name] = counts.get(name, 0) + refs
+    return counts
+
+
+@transaction.atomic
+def recount():
+    """Count the references of every file again, e.g. after bulk writes."""
+    counts = references()
+    MediaFile.objects.all().delete()
+    MediaFile.objects.bulk_create(
+        [MediaFile(name=name, refs=refs) for name, refs in counts.items()],
+        batch_size=500)
+    return counts
+
+
+def stored_files(directory):
+    """Names of the files under directory of the storage."""
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield f'{directory}/{name}'
+    for name in directories:
+        yield from stored_files(f'{directory}/{name}')
+
+
+def orphans(directory, min_age, dry_run=False):
+    """Files under directory no row names, older than min_age seconds:
+    a younger one may belong to a post being saved right now. The
+    counts are fixed on the way unless dry_run."""
+    counts = references() if dry_run else recount()
+    deadline = time.time() - min_age
+    for name in stored_files(directory):
+        if (name not in counts
+                and os.path.getmtime(storage.path(name)) < deadline):
+            yield name
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_follow_counters(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    for field, counted in (('follower_count', 'author_id'),
+                           ('following_count', 'user_id')):
+        counts = Follow.objects.values(counted).annotate(
+            total=Count('id')).order_by()
+        for row in counts.iterator():
+            UserStats.objects.filter(user_id=row[counted]).update(
+                **{field: row['total']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_searchentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Число подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Число подписок'),
+        ),
+        migrations.RunPython(fill_follow_counters, migrations.RunPython.noop),
+    ]
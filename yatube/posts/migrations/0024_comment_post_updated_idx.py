@@ -0,0 +1,17 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0023_timeline_pub_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-updated'], name='comment_post_updated_idx'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import HashedStorage
+
 
 # Create your models here.
 
@@ -26,6 +28,9 @@ class Post(models.Model):
     pub_date = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True)
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -43,18 +48,66 @@ class Post(models.Model):
     )
     image = models.ImageField(
         upload_to='posts/',
+        storage=HashedStorage(),
         blank=True,
         verbose_name="Картинка",
         help_text="Добавьте иллюстрацию к посту. Необязательное поле"
     )
+    # url of the card-sized copy of image, built by posts/thumbnails.py
+    thumbnail = models.CharField(
+        'Миниатюра',
+        max_length=255,
+        blank=True,
+        editable=False)
+    # denormalized count of comments_to_post, see posts/counters.py
+    comment_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False)
 
     class Meta:
         ordering = ("-pub_date",)
+        # every feed is read in FEED_ORDERING (posts/utils.py),
+        # the indexes let the database walk it without sorting
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
 
+class ImageVariant(models.Model):
+    """A copy of the card crop of Post.image in one width and format,
+    built by posts/images.py for the srcset of the post."""
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='image_variants',
+        verbose_name='Пост'
+    )
+    format = models.CharField('Формат', max_length=10)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    # name of the file in the storage of Post.image
+    name = models.CharField('Файл', max_length=255)
+
+    class Meta:
+        unique_together = ['post', 'format', 'width']
+
+
+class MediaFile(models.Model):
+    """A file of HashedStorage with the number of rows naming it,
+    kept by posts/media.py."""
+    name = models.CharField('Файл', max_length=255, unique=True)
+    refs = models.PositiveIntegerField('Число ссылок', default=0)
+
+
 class Comment(models.Model):
     post = models.ForeignKey(
         Post,
@@ -78,6 +131,18 @@ class Comment(models.Model):
     created = models.DateTimeField(
         'Дата публикации комментария',
         auto_now_add=True)
+    updated = models.DateTimeField(
+        'Дата изменения комментария',
+        auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created_idx'),
+            # the last change of the comments of a post, for its ETag
+            models.Index(fields=['post', '-updated'],
+                         name='comment_post_updated_idx'),
+        ]
 
 
 class Follow(models.Model):
@@ -99,3 +164,82 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ['user', 'author']
+        # unique_together covers "whom the user follows",
+        # this one covers "who follows the author"
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Post delivered to the follow feed of a user (fan-out on write)."""
+    user = models.ForeignKey(
+        User,
+        related_name='timeline',
+        on_delete=models.CASCADE,
+        verbose_name='Читатель')
+
+    post = models.ForeignKey(
+        Post,
+        related_name='timeline_entries',
+        on_delete=models.CASCADE,
+        verbose_name='Пост'
+    )
+    # a copy of the date of the post, so the feed is read in order
+    # from the index on the timeline alone
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        unique_together = ['user', 'post']
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """Denormalized counters of a user, see posts/counters.py."""
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='stats',
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь')
+
+    post_count = models.PositiveIntegerField('Число постов', default=0)
+    follower_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Число подписок', default=0)
+    # posts of the user are merged into feeds on read, see posts/timeline.py
+    pulled = models.BooleanField('Посты не рассылаются', default=False)
+
+
+class SearchEntry(models.Model):
+    """Stemmed term of a post or of its comment, see posts/search.py."""
+    term = models.CharField('Терм', max_length=64)
+
+    post = models.ForeignKey(
+        Post,
+        related_name='search_entries',
+        on_delete=models.CASCADE,
+        verbose_name='Пост'
+    )
+
+    # empty for the terms of the post text itself
+    comment = models.ForeignKey(
+        Comment,
+        blank=True,
+        null=True,
+        related_name='search_entries',
+        on_delete=models.CASCADE,
+        verbose_name='Комментарий'
+    )
+
+    weight = models.PositiveIntegerField('Вес')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'post'],
+                         name='search_term_post_idx'),
+        ]
@@ -0,0 +1,162 @@
+"""Full-text search over posts and their comments.
+
+Texts are split into words, the words are stemmed and written into
+the SearchEntry inverted index, one row per (term, document). A query
+reads only the rows of its own terms through the (term, post) index,
+so its cost does not grow with the number of posts.
+"""
+import re
+from collections import Counter
+from functools import lru_cache
+
+from django.db.models import Count, Sum
+
+from .models import Post, SearchEntry
+
+# words of a post weigh more than the same words of a comment
+POST_WEIGHT = 3
+COMMENT_WEIGHT = 1
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+VOWELS = 'аеиоуыэюя'
+
+
+def _longest(word, endings, after_a=()):
+    """Strip the longest of endings and after_a from word.
+
+    Endings from after_a are stripped only after 'а' or 'я'.
+    Return None if word has none of them.
+    """
+    for ending in sorted((*endings, *after_a), key=len, reverse=True):
+        if word.endswith(ending):
+            rest = word[:-len(ending)]
+            if ending in after_a and ending not in endings:
+                if not rest.endswith(('а', 'я')):
+                    return None
+            return rest
+    return None
+
+
+PERFECTIVE_GERUND = (('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'),
+                     ('в', 'вши', 'вшись'))
+ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой',
+             'ем', 'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых',
+             'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (('ивш', 'ывш', 'ующ'),
+              ('ем', 'нн', 'вш', 'ющ', 'щ'))
+REFLEXIVE = ('ся', 'сь')
+VERB = (('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей',
+         'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят',
+         'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+        ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но',
+         'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'))
+NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии',
+        'и', 'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам',
+        'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия',
+        'ья', 'я')
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+
+def _region_start(word, start=0):
+    # position after the first non-vowel following a vowel
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _adjectival(rv):
+    rest = _longest(rv, ADJECTIVE)
+    if rest is None:
+        return None
+    participle = _longest(rest, *PARTICIPLE)
+    return rest if participle is None else participle
+
+
+def _inflection(rv):
+    rest = _longest(rv, *PERFECTIVE_GERUND)
+    if rest is not None:
+        return rest
+    if rv.endswith(REFLEXIVE):
+        rv = rv[:-2]
+    rest = _adjectival(rv)
+    if rest is None:
+        rest = _longest(rv, *VERB)
+    if rest is None:
+        rest = _longest(rv, NOUN)
+    return rv if rest is None else rest
+
+
+def _superlative(rv):
+    if rv.endswith('нн'):
+        return rv[:-1]
+    rest = _longest(rv, SUPERLATIVE)
+    if rest is not None:
+        return rest[:-1] if rest.endswith('нн') else rest
+    return rv[:-1] if rv.endswith('ь') else rv
+
+
+# words repeat a lot, their stems are remembered
+@lru_cache(maxsize=100_000)
+def stem(word):
+    """Russian Snowball stemmer, other words are only lowercased."""
+    word = word.lower().replace('ё', 'е')
+    first_vowel = next(
+        (i for i, letter in enumerate(word) if letter in VOWELS), None)
+    if first_vowel is None:
+        return word
+    prefix, rv = word[:first_vowel + 1], word[first_vowel + 1:]
+    r2 = _region_start(word, _region_start(word)) - len(prefix)
+
+    rv = _inflection(rv)
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    for ending in DERIVATIONAL:
+        if rv.endswith(ending) and len(rv) - len(ending) >= r2:
+            rv = rv[:-len(ending)]
+            break
+    return prefix + _superlative(rv)
+
+
+def terms(text):
+    """Stems of the words of text with the number of their occurrences."""
+    return Counter(
+        stem(word)[:MAX_TERM_LENGTH] for word in WORD_RE.findall(text))
+
+
+def _write(post_id, comment_id, text, weight):
+    SearchEntry.objects.bulk_create(
+        SearchEntry(term=term, post_id=post_id, comment_id=comment_id,
+                    weight=count * weight)
+        for term, count in terms(text).items())
+
+
+def index_post(post):
+    SearchEntry.objects.filter(post=post, comment=None).delete()
+    _write(post.pk, None, post.text, POST_WEIGHT)
+
+
+def index_comment(comment):
+    SearchEntry.objects.filter(comment=comment).delete()
+    _write(comment.post_id, comment.pk, comment.text, COMMENT_WEIGHT)
+
+
+def search_posts(query):
+    """Posts matching every word of query, annotated with their score.
+
+    Order them by SEARCH_ORDERING to get the best matches first. An
+    empty query matches nothing without touching the database.
+    """
+    query_terms = list(terms(query))[:MAX_QUERY_TERMS]
+    return (
+        Post.objects.filter(search_entries__term__in=query_terms)
+        .annotate(score=Sum('search_entries__weight'),
+                  matched=Count('search_entries__term', distinct=True))
+        .filter(matched=len(query_terms))
+    )
+
+
+SEARCH_ORDERING = ('-score', '-id')
@@ -0,0 +1,221 @@
+from django.conf import settings
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import counters, images, media, search, thumbnails, timeline
+from .cache import expire_author_cards, touch_feeds, touch_post_feeds
+from .follows import forget_followed
+from .models import (Comment, Follow, Group, ImageVariant, Post, User,
+                     UserStats)
+
+# fields of the author rendered on the post cards
+CARD_AUTHOR_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(post_save, sender=Post)
+def deliver_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and settings.TIMELINE_ENABLED:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def fill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and settings.TIMELINE_ENABLED:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    if settings.TIMELINE_ENABLED:
+        timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(pre_save, sender=User)
+def check_author_name(sender, instance, update_fields=None, **kwargs):
+    instance._card_name_changed = False
+    if instance.pk is None:
+        return
+    if update_fields and not set(update_fields) & set(CARD_AUTHOR_FIELDS):
+        return
+    old = User.objects.filter(pk=instance.pk).values(
+        *CARD_AUTHOR_FIELDS).first()
+    instance._card_name_changed = old is not None and any(
+        old[field] != getattr(instance, field) for field in old)
+
+
+@receiver(post_save, sender=User)
+def expire_cards_of_author(sender, instance, **kwargs):
+    if getattr(instance, '_card_name_changed', False):
+        expire_author_cards(instance)
+        groups = Post.objects.filter(author=instance).exclude(
+            group=None).order_by().values_list('group_id', flat=True)
+        groups = groups.distinct()
+        touch_feeds(('index',), ('profile', instance.pk),
+                    *(('group', group_id) for group_id in groups))
+        # post pages show the names of the commenters
+        Comment.objects.filter(author=instance).update(
+            updated=timezone.now())
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_post(sender, instance, raw=False, **kwargs):
+    # a post moved to another group leaves the feed of the old one,
+    # a new image needs a new thumbnail, a new text a new search index
+    old = {'group_id': None, 'image': '', 'text': None}
+    if instance.pk is not None:
+        old = Post.objects.filter(pk=instance.pk).values(
+            'group_id', 'image', 'text').first() or old
+    instance._old_group_id = old['group_id']
+    instance._old_image = old['image'] or ''
+    instance._text_changed = not raw and instance.text != old['text']
+    instance._image_changed = (
+        not raw and (instance.image.name or '') != (old['image'] or ''))
+    if instance._image_changed:
+        instance.thumbnail = ''
+
+
+@receiver(post_save, sender=Post)
+def build_thumbnail(sender, instance, **kwargs):
+    if not getattr(instance, '_image_changed', False):
+        return
+    if instance.image:
+        # the variants of the old image are replaced by the build
+        thumbnails.schedule(instance.pk)
+    else:
+        images.drop_variants(instance)
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, raw=False, **kwargs):
+    # the name of a new image is only known once it is stored,
+    # the same content keeps the name
+    old = getattr(instance, '_old_image', '')
+    if not raw and (instance.image.name or '') != old:
+        media.acquire(instance.image.name)
+        media.release(old)
+
+
+@receiver(post_delete, sender=Post)
+def release_image(sender, instance, **kwargs):
+    media.release(instance.image.name)
+
+
+@receiver(post_delete, sender=ImageVariant)
+def release_variant(sender, instance, **kwargs):
+    media.release(instance.name)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    if getattr(instance, '_text_changed', False):
+        search.index_post(instance)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    # search entries of deleted posts and comments go away by CASCADE
+    if not raw:
+        search.index_comment(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def expire_post_feeds(sender, instance, **kwargs):
+    touch_post_feeds(instance, getattr(instance, '_old_group_id', None))
+
+
+def _expire_group_cards(group):
+    # the profiles of the authors show the cards of the group too
+    posts = Post.objects.filter(group=group)
+    group._author_ids = list(
+        posts.order_by().values_list('author_id', flat=True).distinct())
+    posts.update(updated=timezone.now())
+
+
+@receiver(pre_save, sender=Group)
+def expire_group_cards(sender, instance, **kwargs):
+    # cards link to the group by slug
+    instance._author_ids = []
+    if instance.pk is None:
+        return
+    old_slug = Group.objects.filter(
+        pk=instance.pk).values_list('slug', flat=True).first()
+    if old_slug != instance.slug:
+        _expire_group_cards(instance)
+
+
+@receiver(pre_delete, sender=Group)
+def expire_orphaned_cards(sender, instance, **kwargs):
+    # posts of the group lose it by SET_NULL without any signals
+    _expire_group_cards(instance)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def expire_group_feeds(sender, instance, **kwargs):
+    touch_feeds(('index',), ('group', instance.pk),
+                *(('profile', author_id)
+                  for author_id in getattr(instance, '_author_ids', ())))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def expire_follow_feeds(sender, instance, **kwargs):
+    touch_feeds(('profile', instance.author_id), ('profile', instance.user_id))
+
+
+@receiver(post_save, sender=User)
+def create_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_user_counter(instance.author_id, 'post_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change_user_counter(instance.author_id, 'post_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_user_counter(instance.author_id, 'follower_count', 1)
+        counters.change_user_counter(instance.user_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.change_user_counter(instance.author_id, 'follower_count', -1)
+    counters.change_user_counter(instance.user_id, 'following_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def update_pulled_author(sender, instance, raw=False, **kwargs):
+    # after the follower counter above has changed
+    if not raw and settings.TIMELINE_ENABLED:
+        timeline.sync_pulled([instance.author_id])
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def expire_followed(sender, instance, **kwargs):
+    forget_followed(instance.user_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_comment_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.change_comment_count(instance.post_id, -1)
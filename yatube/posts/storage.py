@@ -0,0 +1,43 @@
+"""Storage of the post images naming files by their content.
+
+A file is stored as <directory>/<sha256[:2]>/<sha256[2:]><extension>,
+so the same image uploaded twice, by anyone, is stored once and its
+URL never changes its content. Which files are still used is counted
+by posts/media.py.
+"""
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{62}(\.\w+)?$')
+
+
+def is_hashed(name):
+    return HASHED_NAME.search(name) is not None
+
+
+@deconstructible
+class HashedStorage(FileSystemStorage):
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        name = posixpath.join(
+            posixpath.dirname(name), digest[:2],
+            digest[2:] + os.path.splitext(name)[1].lower())
+        if self.exists(name):
+            return name
+        # two saves of a new file at once may store it twice, the
+        # second under a suffixed name counted like any other
+        return super().save(name, content, max_length)
@@ -0,0 +1,11 @@
+from django import template
+
+from ..cache import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, page_obj):
+    """Rendered cards of the posts on the page, in the page order."""
+    return render_cards(list(page_obj), context.get('is_profile', False))
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class FeedApiTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='TestUser')
+        cls.reader = User.objects.create(username='Reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-group', description='')
+        Post.objects.bulk_create([
+            Post(text=f'Тестовый пост {i}', author=cls.user, group=cls.group)
+            for i in range(settings.POSTS_PER_PAGE + 3)
+        ])
+        cls.post = Post.objects.first()
+        Comment.objects.create(post=cls.post, author=cls.reader,
+                               text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_feeds(self):
+        urls = [
+            reverse('posts:api_index'),
+            reverse('posts:api_group', args=[self.group.slug]),
+            reverse('posts:api_profile', args=[self.user.username]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                page = self.client.get(url).json()
+                self.assertEqual(len(page['results']),
+                                 settings.POSTS_PER_PAGE)
+                self.assertEqual(page['results'][0]['author'], 'TestUser')
+                page = self.client.get(url, {'after': page['next']}).json()
+                self.assertEqual(len(page['results']), 3)
+                self.assertIsNone(page['next'])
+
+        response = self.client.get(
+            reverse('posts:api_group', args=['no-such-group']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_fields(self):
+        url = reverse('posts:api_index')
+        page = self.client.get(url, {'fields': 'id,text'}).json()
+        self.assertEqual(set(page['results'][0]), {'id', 'text'})
+        response = self.client.get(url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+        url = reverse('posts:api_comments', args=[self.post.pk])
+        page = self.client.get(url, {'fields': 'author,text'}).json()
+        self.assertEqual(page['results'],
+                         [{'author': 'Reader', 'text': 'Комментарий'}])
+
+    # an unchanged feed is revalidated without reading posts
+    def test_conditional_get(self):
+        url = reverse('posts:api_index')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, {'fields': 'id'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        Post.objects.create(text='Новый пост', author=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['text'], 'Новый пост')
+
+    def test_follow_feed(self):
+        url = reverse('posts:api_follow_index')
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+        response = self.reader_client.get(url)
+        self.assertEqual(response.json()['results'], [])
+        etag = response['ETag']
+        Follow.objects.create(user=self.reader, author=self.user)
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']),
+                         settings.POSTS_PER_PAGE)
+
+        etag = response['ETag']
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(text='Новый пост', author=self.user)
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    # the posts carry the slug of their group
+    def test_group_rename_revalidates(self):
+        Follow.objects.create(user=self.reader, author=self.user)
+        clients = {
+            reverse('posts:api_profile', args=[self.user.username]):
+                self.client,
+            reverse('posts:api_follow_index'): self.reader_client,
+        }
+        etags = {url: client.get(url)['ETag']
+                 for url, client in clients.items()}
+        self.group.slug = 'new-group'
+        self.group.save()
+        for url, client in clients.items():
+            with self.subTest(url=url):
+                response = client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['results'][0]['group'],
+                                 'new-group')
@@ -0,0 +1,255 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.test import LiveServerTestCase, TestCase, override_settings
+
+from .. import media
+from ..models import (Comment, Follow, Group, MediaFile, Post, SearchEntry,
+                      TimelineEntry, User, UserStats)
+from ..search import search_posts
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+class ExportImportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='Author',
+                                          first_name='Имя')
+        self.reader = User.objects.create(username='Reader')
+        self.group = Group.objects.create(title='Группа', slug='group',
+                                          description='Описание')
+        self.post = Post.objects.create(text='Пост про котов',
+                                        author=self.author, group=self.group)
+        Post.objects.create(text='Пост без группы', author=self.reader)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий про собак')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.path = os.path.join(tempfile.mkdtemp(), 'posts.ndjson.gz')
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.rmdir(os.path.dirname(self.path))
+
+    def test_round_trip(self):
+        call_command('export_posts', self.path, stderr=StringIO())
+        pub_date = self.post.pub_date
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.assertFalse(Post.objects.exists())
+
+        call_command('import_posts', self.path, '--batch-size', '1',
+                     stdout=StringIO(), stderr=StringIO())
+        post = Post.objects.get(text='Пост про котов')
+        self.assertEqual(post.pub_date, pub_date)
+        self.assertEqual(post.author.first_name, 'Имя')
+        self.assertEqual(post.group.description, 'Описание')
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(post.comments_to_post.get().author.username,
+                         'Reader')
+        self.assertTrue(Follow.objects.filter(
+            user__username='Reader', author__username='Author').exists())
+        self.assertEqual(Post.objects.count(), 2)
+
+        stats = UserStats.objects.get(user=post.author)
+        self.assertEqual((stats.post_count, stats.follower_count), (1, 1))
+        self.assertEqual(list(search_posts('собака')), [post])
+        self.assertIn(post, Post.objects.filter(
+            timeline_entries__user__username='Reader'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class SeedLoadTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def seed(self, *args):
+        call_command('seed_load', '--users', '50', '--posts', '300',
+                     '--groups', '3', *args,
+                     stdout=StringIO(), stderr=StringIO())
+
+    def test_seed(self):
+        self.seed('--images', '0.5')
+        self.assertEqual(User.objects.filter(
+            username__startswith='seed_').count(), 50)
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertTrue(Post.objects.exclude(image='').exists())
+        self.assertEqual(
+            sum(Post.objects.values_list('comment_count', flat=True)),
+            Comment.objects.count())
+        post = Post.objects.exclude(comment_count=0).first()
+        self.assertTrue(post.comments_to_post.filter(
+            created__gte=post.pub_date).exists())
+
+        stats = UserStats.objects.order_by('-follower_count')
+        counts = list(stats.values_list('follower_count', flat=True))
+        self.assertEqual(sum(counts), Follow.objects.count())
+        # a few authors have most of the followers
+        self.assertGreater(counts[0], 5 * counts[len(counts) // 2])
+        self.assertEqual(stats[0].post_count, Post.objects.filter(
+            author=stats[0].user).count())
+
+        self.assertTrue(SearchEntry.objects.filter(comment=None).exists())
+        word = post.text.split()[0]
+        self.assertIn(post, search_posts(word))
+        follow = Follow.objects.filter(author=post.author).first()
+        if follow:
+            self.assertTrue(TimelineEntry.objects.filter(
+                user=follow.user, post=post).exists())
+
+    def test_prefix_taken(self):
+        self.seed('--skip-search')
+        self.assertFalse(SearchEntry.objects.exists())
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class LoadTestTests(LiveServerTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create(username='load_reader')
+        self.reader.set_password('secret')
+        self.reader.save()
+        author = User.objects.create(username='load_author')
+        Post.objects.create(text='Пост', author=author)
+        Follow.objects.create(user=self.reader, author=author)
+
+    def test_report(self):
+        out = StringIO()
+        call_command('load_test', '--url', self.live_server_url,
+                     '--requests', '20', '--concurrency', '2',
+                     '--prefix', 'load', '--password', 'secret',
+                     '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['total']['requests'], 20)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertEqual(
+            sum(row['requests'] for row in report['views']), 20)
+        self.assertLessEqual(report['total']['p50_ms'],
+                             report['total']['p99_ms'])
+
+
+class BenchUploadsTests(TestCase):
+
+    def test_report(self):
+        out = StringIO()
+        call_command('bench_uploads', '--megapixels', '0.1,0.2', '--json',
+                     stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual([row['megapixels'] for row in report], [0.1, 0.2])
+        for row in report:
+            self.assertNotIn('error', row)
+            self.assertGreater(row['variants'], 0)
+            self.assertGreaterEqual(row['variants_mb'], 0)
+
+
+class ExplainFeedsTests(TestCase):
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_feeds_read_in_index_order(self):
+        group = Group.objects.create(title='Группа', slug='group')
+        author, reader, other = (
+            User.objects.create(username=name)
+            for name in ('Author', 'Reader', 'Other'))
+        popular = User.objects.create(username='Popular')
+        Follow.objects.create(user=reader, author=author)
+        for user in (reader, other):
+            # more followers than the limit: pulled into the feed
+            Follow.objects.create(user=user, author=popular)
+        for i in range(5):
+            post = Post.objects.create(text=f'Пост {i}', author=author,
+                                       group=group)
+            Post.objects.create(text=f'Пост {i}', author=popular)
+        Comment.objects.create(post=post, author=reader, text='Комментарий')
+
+        for options in ([], ['--deep']):
+            out = StringIO()
+            call_command('explain_feeds', *options, stdout=out)
+            plans = out.getvalue()
+            with self.subTest(options=options):
+                for name in ('index', 'group_posts', 'profile',
+                             'follow_index: posts_timelineentry',
+                             'follow_index: posts_post',
+                             'post_detail comments'):
+                    self.assertIn(name, plans)
+                self.assertNotIn('TEMP B-TREE', plans)
+
+
+class RebuildSearchTests(TestCase):
+
+    def test_index_rebuilt(self):
+        author = User.objects.create(username='Author')
+        post = Post.objects.create(text='Рыжие коты', author=author)
+        Comment.objects.create(post=post, author=author, text='Пушистые')
+        indexed = set(SearchEntry.objects.values_list(
+            'term', 'post', 'comment', 'weight'))
+        SearchEntry.objects.all().delete()
+        SearchEntry.objects.create(term='лишний', post=post, weight=1)
+
+        out = StringIO()
+        call_command('rebuild_search', stdout=out)
+        self.assertIn('2', out.getvalue())
+        self.assertEqual(set(SearchEntry.objects.values_list(
+            'term', 'post', 'comment', 'weight')), indexed)
+        self.assertEqual(list(search_posts('пушистый кот')), [post])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaGcTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_orphans_deleted(self):
+        author = User.objects.create(username='Author')
+        used = media.storage.save('posts/used.gif', ContentFile(b'used'))
+        orphan = media.storage.save('posts/orphan.gif', ContentFile(b'gone'))
+        # written around the signals, e.g. by an import
+        Post.objects.bulk_create(
+            [Post(text='Пост', author=author, image=used)])
+
+        out = StringIO()
+        call_command('media_gc', '--min-age', '0', '--dry-run', stdout=out)
+        self.assertIn(orphan, out.getvalue())
+        self.assertTrue(media.storage.exists(orphan))
+
+        call_command('media_gc', '--min-age', '0', stdout=StringIO())
+        self.assertFalse(media.storage.exists(orphan))
+        self.assertTrue(media.storage.exists(used))
+        self.assertEqual(MediaFile.objects.get(name=used).refs, 1)
+
+        # young files may belong to posts being saved
+        young = media.storage.save('posts/young.gif', ContentFile(b'new'))
+        call_command('media_gc', stdout=StringIO())
+        self.assertTrue(media.storage.exists(young))
+
+    # a dry run changes neither the files nor the counts
+    def test_dry_run_read_only(self):
+        author = User.objects.create(username='Author')
+        used = media.storage.save('posts/used.gif', ContentFile(b'used'))
+        Post.objects.bulk_create(
+            [Post(text='Пост', author=author, image=used)])
+        MediaFile.objects.create(name='posts/gone.gif', refs=3)
+        rows = list(MediaFile.objects.values_list('name', 'refs'))
+
+        call_command('media_gc', '--min-age', '0', '--dry-run',
+                     stdout=StringIO())
+        self.assertEqual(
+            list(MediaFile.objects.values_list('name', 'refs')), rows)
@@ -1,16 +1,26 @@
+import hashlib
 import shutil
+import struct
 import tempfile
+import zlib
+from io import BytesIO
 
-from django.test import TestCase, Client, override_settings
+from django.test import (TestCase, TransactionTestCase, Client,
+                         override_settings)
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
-from ..models import Post, Group, Comment
+from django.core.files.storage import default_storage
+from PIL import Image
+from ..models import ImageVariant, MediaFile, Post, Group, Comment
+from .. import images, thumbnails
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from http import HTTPStatus
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 User = get_user_model()
+# the EXIF tag of the orientation of a photo
+ORIENTATION = 0x0112
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -65,8 +75,10 @@ class PostFormTest(TestCase):
         self.assertEqual(post.text, post_text)
         self.assertEqual(post.author, self.author)
         self.assertEqual(post.group, PostFormTest.group)
-        self.assertEqual(post.image.name, 'posts/'
-                         + PostFormTest.uploaded.name)
+        # images are named by the hash of their content
+        digest = hashlib.sha256(PostFormTest.small_gif).hexdigest()
+        self.assertEqual(post.image.name,
+                         f'posts/{digest[:2]}/{digest[2:]}.gif')
         self.assertEqual(response.status_code, HTTPStatus.OK)
 
     def test_edit_post_form(self):
@@ -105,6 +117,107 @@ class PostFormTest(TestCase):
         self.assertEqual(
             old_group_response.context['page_obj'].paginator.count, 0)
 
+    def test_thumbnail_built_for_new_image(self):
+        post = Post.objects.create(
+            text='test',
+            author=self.author,
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=PostFormTest.small_gif,
+                content_type='image/gif'))
+        self.assertEqual(post.thumbnail, '')
+
+        thumbnails.build(post.id)
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnail.startswith(settings.MEDIA_URL))
+
+        # a replaced image drops the thumbnail until it is built again
+        post.image = SimpleUploadedFile(
+            name='other.gif',
+            content=PostFormTest.small_gif,
+            content_type='image/gif')
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.thumbnail, '')
+
+    def test_image_variants(self):
+        photo = BytesIO()
+        exif = Image.Exif()
+        # turned by 90 degrees, the variants are 600 pixels wide
+        exif[ORIENTATION] = 6
+        Image.new('RGB', (1000, 600), 'red').save(photo, 'JPEG', exif=exif)
+        post = Post.objects.create(
+            text='test',
+            author=self.author,
+            image=SimpleUploadedFile(
+                name='photo.jpg',
+                content=photo.getvalue(),
+                content_type='image/jpeg'))
+        thumbnails.build(post.id)
+
+        variants = list(post.image_variants.all())
+        self.assertIn('webp', images.formats())
+        self.assertEqual(
+            {(variant.format, variant.width, variant.height)
+             for variant in variants},
+            {(name, width, round(width * 339 / 960))
+             for name in images.formats() for width in (320, 480)})
+        for variant in variants:
+            with default_storage.open(variant.name) as file, \
+                    Image.open(file) as image:
+                self.assertEqual(image.size, (variant.width, variant.height))
+                self.assertNotIn('exif', image.info)
+
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', args=[post.id]))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(
+            response, default_storage.url(variants[0].name))
+        self.assertContains(response, 'width="960" height="339"')
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'type="image/webp"')
+
+        # a removed image takes its variants along,
+        # their files go on commit, see MediaTests
+        post.image = ''
+        post.save()
+        self.assertFalse(post.image_variants.exists())
+
+    def post_image(self, name, content):
+        return self.authorized_client.post(reverse('posts:post_create'), {
+            'text': 'Пост с большой картинкой',
+            'image': SimpleUploadedFile(name, content)})
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=20)
+    def test_too_large_image_rejected(self):
+        response = self.post_image('small.gif', PostFormTest.small_gif)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.context['form'].errors.as_data()[
+            'image'][0].code, 'too_large')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_MAX_PIXELS=1)
+    def test_too_many_pixels_rejected(self):
+        response = self.post_image('small.gif', PostFormTest.small_gif)
+        self.assertEqual(response.context['form'].errors.as_data()[
+            'image'][0].code, 'too_many_pixels')
+        self.assertFalse(Post.objects.exists())
+
+    # a few bytes declaring more pixels than Pillow agrees to decode
+    def test_decompression_bomb_rejected(self):
+        def chunk(kind, data):
+            return (struct.pack('>I', len(data)) + kind + data
+                    + struct.pack('>I', zlib.crc32(kind + data)))
+        bomb = (b'\x89PNG\r\n\x1a\n'
+                + chunk(b'IHDR', struct.pack('>IIBBBBB', 50000, 50000,
+                                             8, 0, 0, 0, 0))
+                + chunk(b'IDAT', zlib.compress(b'\0' * 10))
+                + chunk(b'IEND', b''))
+        response = self.post_image('bomb.png', bomb)
+        self.assertEqual(response.context['form'].errors.as_data()[
+            'image'][0].code, 'invalid_image')
+        self.assertFalse(Post.objects.exists())
+
     def test_unauth_user_cant_publish_post(self):
         form_data = {
             'text': 'Текст нежелательного поста',
@@ -171,4 +284,62 @@ class CommentsTests(TestCase):
 
         response = self.authorized_client.get(reverse(
             'posts:post_detail', args=[CommentsTests.post.id]))
-        self.assertEqual(*response.context.get('comments').all(), comment)
+        self.assertEqual(*response.context.get('comments'), comment)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaTests(TransactionTestCase):
+    # files are deleted once the transaction commits
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.author = User.objects.create(username='Author')
+
+    def create_post(self, color):
+        content = BytesIO()
+        Image.new('RGB', (4, 4), color).save(content, 'PNG')
+        return Post.objects.create(
+            text='Пост', author=self.author,
+            image=SimpleUploadedFile('image.png', content.getvalue()))
+
+    def refs(self, name):
+        return MediaFile.objects.filter(name=name).values_list(
+            'refs', flat=True).first()
+
+    def test_same_image_stored_once(self):
+        first = self.create_post('red')
+        second = self.create_post('red')
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(self.refs(name), 2)
+
+        first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(self.refs(name), 1)
+        second.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertIsNone(self.refs(name))
+
+    def test_replaced_image_collected(self):
+        post = self.create_post('red')
+        old = post.image.name
+        # the thumbnails were built on commit
+        variants = list(ImageVariant.objects.filter(post=post))
+        self.assertTrue(variants)
+        self.assertEqual(self.refs(variants[0].name), 1)
+
+        post.image = self.create_post('blue').image
+        post.save()
+        self.assertFalse(default_storage.exists(old))
+        self.assertIsNone(self.refs(old))
+        self.assertEqual(self.refs(post.image.name), 2)
+        for variant in variants:
+            self.assertFalse(default_storage.exists(variant.name))
+
+        post.delete()
+        self.assertTrue(default_storage.exists(post.image.name))
+        self.assertEqual(self.refs(post.image.name), 1)
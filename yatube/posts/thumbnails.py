@@ -0,0 +1,101 @@
+"""Thumbnails of post images built off the request path.
+
+Saving a post with a new image schedules the thumbnail and the
+responsive variants of posts/images.py on a local thread pool once
+the transaction commits; cards show a placeholder until
+Post.thumbnail is filled in. THUMBNAIL_WORKERS = 0 builds
+thumbnails right in the committing thread, and so does an in-memory
+database. Other work kept off the request path, like the fan-out of
+posts/timeline.py, goes to the same pool by submit().
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
+
+from . import images, media
+from .cache import touch_post_feeds
+from .models import ImageVariant, Post
+
+GEOMETRY = f'{images.CARD_WIDTH}x{images.CARD_HEIGHT}'
+OPTIONS = {'crop': 'center', 'upscale': True}
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+    return _executor
+
+
+def in_background():
+    # threads share an in-memory SQLite database, like the one of
+    # the tests, only through its cache, whose table locks fail
+    # at once instead of waiting: there thumbnails are built in place
+    database = connections['default']
+    in_memory = (database.vendor == 'sqlite'
+                 and database.is_in_memory_db())
+    return settings.THUMBNAIL_WORKERS and not in_memory
+
+
+def submit(function, *args):
+    """Call function(*args) on the pool once the transaction commits."""
+    if in_background():
+        transaction.on_commit(
+            lambda: executor().submit(_in_worker, function, *args))
+    else:
+        transaction.on_commit(lambda: function(*args))
+
+
+def _in_worker(function, *args):
+    try:
+        function(*args)
+    finally:
+        # worker threads live long, don't keep their connections open
+        connections.close_all()
+
+
+def schedule(post_id):
+    submit(build, post_id)
+
+
+def build(post_id):
+    post = Post.objects.filter(pk=post_id).first()
+    if post is None or not post.image:
+        return
+    try:
+        url = get_thumbnail(post.image, GEOMETRY, **OPTIONS).url
+        variants = images.build_variants(post) if url else []
+    except Exception:
+        logger.exception('Не удалось построить миниатюру поста %s', post_id)
+        return
+    if not url:
+        # sorl returns a dummy image instead of raising
+        # when THUMBNAIL_DEBUG is off
+        return
+    with transaction.atomic():
+        # the image may have been replaced while the thumbnail was built
+        updated = Post.objects.filter(
+            pk=post_id, image=post.image.name).update(
+                thumbnail=url, updated=timezone.now())
+        names = [variant.name for variant in variants]
+        if updated:
+            ImageVariant.objects.filter(post_id=post_id).delete()
+            ImageVariant.objects.bulk_create(variants)
+            media.acquire(*names)
+        else:
+            media.discard(*names)
+    if updated:
+        touch_post_feeds(post)
@@ -0,0 +1,233 @@
+"""Precomputed follow feed.
+
+New posts are written into the timelines of the author's followers
+(fan-out on write), so the follow feed is read in order from the index
+on one table instead of joining Follow on every request. Authors with
+more than TIMELINE_FANOUT_LIMIT followers are pulled: their posts are
+not fanned out but merged into the feed on read. When such an author
+falls back under TIMELINE_RELEASE_LIMIT, the posts are fanned out.
+"""
+import heapq
+from functools import partial
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max, Q
+
+from . import thumbnails
+from .bulk import insert_rows
+from .follows import followed_authors
+from .models import Follow, Post, TimelineEntry, UserStats
+from .utils import FEED_ORDERING, KeysetPaginator
+
+PULLED_AUTHORS_KEY = 'timeline:pulled_authors'
+PULLED_AUTHORS_TIMEOUT = 60 * 5
+CHUNK_SIZE = 1000
+# the same key as FEED_ORDERING, read from the timeline
+ENTRY_ORDERING = ('-pub_date', '-post_id')
+
+
+def pulled_authors():
+    """Ids of authors whose posts are merged into feeds on read."""
+    authors = cache.get(PULLED_AUTHORS_KEY)
+    if authors is None:
+        authors = set(UserStats.objects.filter(
+            pulled=True).values_list('user_id', flat=True))
+        cache.set(PULLED_AUTHORS_KEY, authors, PULLED_AUTHORS_TIMEOUT)
+    return authors
+
+
+def forget_pulled():
+    cache.delete(PULLED_AUTHORS_KEY)
+    # a request reading the old set before the commit
+    # could have put it back into the cache
+    transaction.on_commit(lambda: cache.delete(PULLED_AUTHORS_KEY))
+
+
+def _deliver(entries):
+    # large fan-outs are written chunk by chunk
+    adapt = connection.ops.adapt_datetimefield_value
+    entries = iter(entries)
+    while True:
+        chunk = [(user_id, post_id, adapt(pub_date))
+                 for user_id, post_id, pub_date
+                 in islice(entries, CHUNK_SIZE)]
+        if not chunk:
+            return
+        insert_rows(TimelineEntry, ('user', 'post', 'pub_date'), chunk,
+                    ignore_conflicts=True)
+
+
+def fan_out(post):
+    fan_out_many([post])
+
+
+def fan_out_many(posts):
+    """Deliver posts to the followers of their authors at once."""
+    posts_of = {}
+    for post in posts:
+        posts_of.setdefault(post.author_id, []).append(post)
+    authors = posts_of.keys() - pulled_authors()
+    if not authors:
+        return
+    followers = Follow.objects.filter(
+        author_id__in=authors).values_list('author_id', 'user_id')
+    _deliver((user_id, post.id, post.pub_date)
+             for author_id, user_id in followers.iterator()
+             for post in posts_of[author_id])
+
+
+def backfill(user_id, author_id):
+    if author_id in pulled_authors():
+        return
+    posts = Post.objects.filter(
+        author_id=author_id).values_list('id', 'pub_date')
+    _deliver((user_id, post_id, pub_date)
+             for post_id, pub_date in posts.iterator())
+
+
+def _fan_out_author(author_id, posts, followers):
+    """Deliver the posts of author among posts to the followers among
+    followers, a chunk of the followers at a time."""
+    posts = list(posts.filter(author_id=author_id).values_list(
+        'id', 'pub_date'))
+    if not posts:
+        return
+    followers = followers.filter(author_id=author_id).values_list(
+        'user_id', flat=True).iterator()
+    while True:
+        chunk = list(islice(followers, max(CHUNK_SIZE // len(posts), 1)))
+        if not chunk:
+            return
+        _deliver((user_id, post_id, pub_date)
+                 for user_id in chunk for post_id, pub_date in posts)
+
+
+def release(author_id):
+    """Fan out the posts of a pulled author back under
+    TIMELINE_RELEASE_LIMIT, then stop pulling the author.
+
+    The posts are fanned out while the author is still pulled, so
+    the feeds keep showing them all along; the posts and the follows
+    made meanwhile were neither fanned out nor backfilled and are
+    delivered once the author is released.
+    """
+    stats = UserStats.objects.filter(
+        user_id=author_id, pulled=True,
+        follower_count__lte=settings.TIMELINE_RELEASE_LIMIT)
+    if not stats.exists():
+        # released already or followed again
+        return
+    last_post = Post.objects.filter(author_id=author_id).aggregate(
+        last=Max('id'))['last'] or 0
+    last_follow = Follow.objects.filter(author_id=author_id).aggregate(
+        last=Max('id'))['last'] or 0
+    _fan_out_author(author_id, Post.objects.filter(id__lte=last_post),
+                    Follow.objects.filter(id__lte=last_follow))
+    if not stats.update(pulled=False):
+        return
+    forget_pulled()
+    # after the cache is dropped, so the posts published and the
+    # follows made from now on are fanned out and backfilled
+    _fan_out_author(author_id, Post.objects.filter(id__gt=last_post),
+                    Follow.objects.all())
+    _fan_out_author(author_id, Post.objects.filter(id__lte=last_post),
+                    Follow.objects.filter(id__gt=last_follow))
+
+
+def sync_pulled(author_ids=None):
+    """Pull the authors followed by more than TIMELINE_FANOUT_LIMIT
+    users and release the pulled ones followed by no more than
+    TIMELINE_RELEASE_LIMIT, after their follower counts changed.
+
+    The limits differ, so an author followed and unfollowed around one
+    of them isn't fanned out again on every follow. The release writes
+    a timeline entry per post and follower, so it is done off the
+    request by the pool of posts/thumbnails.py after the commit.
+    """
+    stats = UserStats.objects.all()
+    if author_ids is not None:
+        stats = stats.filter(user_id__in=author_ids)
+    if stats.filter(
+            pulled=False,
+            follower_count__gt=settings.TIMELINE_FANOUT_LIMIT,
+    ).update(pulled=True):
+        forget_pulled()
+    released = stats.filter(
+        pulled=True, follower_count__lte=settings.TIMELINE_RELEASE_LIMIT)
+    for author_id in released.values_list('user_id', flat=True):
+        thumbnails.submit(release, author_id)
+
+
+def prune(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def follow_feed(user):
+    """Queryset of the posts shown in the follow feed of user.
+
+    It serves the offset pages and the counts; the keyset pages are
+    read from the timeline itself by follow_paginator().
+    """
+    if not settings.TIMELINE_ENABLED:
+        return Post.objects.filter(author__following__user=user)
+
+    pulled = pulled_authors()
+    if pulled:
+        pulled = pulled.intersection(followed_authors(user.pk))
+    if not pulled:
+        return Post.objects.filter(timeline_entries__user=user)
+
+    entries = TimelineEntry.objects.filter(user=user).values('post_id')
+    return Post.objects.filter(
+        Q(pk__in=entries) | Q(author_id__in=pulled))
+
+
+class TimelinePaginator(KeysetPaginator):
+    """Keyset pages of the follow feed of user.
+
+    The keys of a page are read from the timeline index and merged with
+    those of the followed pulled authors, each read from the index of
+    the posts of its author; then the posts are fetched by their ids.
+    object_list is the follow_feed() queryset the posts are taken from.
+    """
+
+    def __init__(self, object_list, per_page, ordering=FEED_ORDERING,
+                 user=None):
+        super().__init__(object_list, per_page, ordering)
+        self.user = user
+
+    def streams(self):
+        """Querysets of (pub_date, id) of the posts of the feed."""
+        yield TimelineEntry.objects.filter(user=self.user).values_list(
+            'pub_date', 'post_id'), ENTRY_ORDERING
+        pulled = pulled_authors() & followed_authors(self.user.pk)
+        for author_id in sorted(pulled):
+            yield Post.objects.filter(author_id=author_id).values_list(
+                'pub_date', 'id'), FEED_ORDERING
+
+    def rows(self, values, backwards, limit):
+        if not settings.TIMELINE_ENABLED:
+            return super().rows(values, backwards, limit)
+        keys = heapq.merge(
+            *(KeysetPaginator(queryset, limit, ordering).rows(
+                values, backwards, limit)
+              for queryset, ordering in self.streams()),
+            reverse=not backwards)
+        ids = []
+        for _, post_id in keys:
+            # posts of a newly pulled author are in both
+            if post_id not in ids:
+                ids.append(post_id)
+            if len(ids) == limit:
+                break
+        posts = self.object_list.in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+def follow_paginator(user):
+    """Paginator class of the keyset pages of the follow feed of user."""
+    return partial(TimelinePaginator, user=user)
@@ -0,0 +1,69 @@
+"""Limits of the uploaded post images.
+
+An image is checked before anything decodes its pixels: the upload
+handler stops storing a file once it grows past IMAGE_UPLOAD_MAX_SIZE,
+and PostForm checks the size in pixels from the header of the image.
+Files larger than FILE_UPLOAD_MAX_MEMORY_SIZE are streamed to a
+temporary file by the Django handlers standing after ours.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.template.defaultfilters import filesizeformat
+
+
+class RejectedUpload(UploadedFile):
+    """The empty stand-in of a file dropped for its size."""
+
+    def __init__(self, name, content_type, size):
+        super().__init__(BytesIO(), name, content_type, size)
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Drop the rest of a file growing past IMAGE_UPLOAD_MAX_SIZE.
+
+    Post images are the only uploads. The chunks past the limit are
+    not handed to the next handlers, so they are neither kept in
+    memory nor written to disk, and the form gets a RejectedUpload.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received = start + len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_SIZE:
+            return None
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.received > settings.IMAGE_UPLOAD_MAX_SIZE:
+            return RejectedUpload(
+                self.file_name, self.content_type, self.received)
+        return None
+
+
+def check_image(image):
+    """Raise ValidationError for an uploaded image past the limits.
+
+    ImageField has only read the header of the image so far, its
+    size is known without decoding the pixels. Images past the limit
+    of Pillow itself are reported by ImageField as invalid.
+    """
+    if isinstance(image, RejectedUpload) or (
+            image.size > settings.IMAGE_UPLOAD_MAX_SIZE):
+        raise ValidationError(
+            'Файл больше %(limit)s.', code='too_large',
+            params={'limit': filesizeformat(settings.IMAGE_UPLOAD_MAX_SIZE)})
+    width, height = image.image.size
+    if (max(width, height) > settings.IMAGE_MAX_SIDE
+            or width * height > settings.IMAGE_MAX_PIXELS):
+        raise ValidationError(
+            'Картинка больше %(limit)s пикселей по стороне '
+            'или %(pixels)s мегапикселей.', code='too_many_pixels',
+            params={'limit': settings.IMAGE_MAX_SIDE,
+                    'pixels': settings.IMAGE_MAX_PIXELS // 10 ** 6})
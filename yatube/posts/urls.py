@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'posts'
 
@@ -10,9 +10,14 @@ urlpatterns = [
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
+    path('posts/<int:post_id>/comments/',
+         views.comments,
+         name='comments'),
     path('posts/<int:post_id>/comment/',
          views.add_comment,
          name='add_comment'),
+    path('search/', views.search, name='search'),
+    path('search/json/', views.search_json, name='search_json'),
     path('follow/', views.follow_index, name='follow_index'),
     path(
         'profile/<str:username>/follow/',
@@ -24,4 +29,18 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path('api/v1/posts/', api.index, name='api_index'),
+    path('api/v1/group/<slug:slug>/posts/',
+         api.group_posts,
+         name='api_group'),
+    path('api/v1/profile/<str:username>/posts/',
+         api.profile,
+         name='api_profile'),
+    path('api/v1/follow/posts/', api.follow_index, name='api_follow_index'),
+    path('api/v1/posts/<int:post_id>/',
+         api.post_detail,
+         name='api_post_detail'),
+    path('api/v1/posts/<int:post_id>/comments/',
+         api.comments,
+         name='api_comments'),
 ]
@@ -1,8 +1,266 @@
+import base64
+import binascii
+import datetime
+import json
+import math
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+from .cache import feed_version
+
+# ordering of every feed: the newest posts first,
+# id breaks ties between posts published at the same moment
+FEED_ORDERING = ('-pub_date', '-id')
+# comments are read in the order they were written
+COMMENTS_ORDERING = ('created', 'id')
+# the range of the integers a database column holds
+KEY_INT_MIN, KEY_INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds,
+    # but the seek key has to be compared exactly
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    """Pack the seek key of a row into an opaque url-safe token."""
+    raw = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, length):
+    """Unpack a token made by encode_cursor, None if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def cursor_page(rows, paginator, next_cursor, previous_cursor):
+    """Page of KeysetPaginator, known by the cursors of its neighbours.
+
+    Its number is unknown without counting the rows before it, so
+    `number` is None and has_next() and has_previous() are answered by
+    the cursors instead. The class is the plain Page all the same: the
+    feeds are checked to pass exactly a Page to their templates.
+    """
+    page = Page(rows, None, paginator)
+    page.next_cursor = next_cursor
+    page.previous_cursor = previous_cursor
+    page.has_next = lambda: page.next_cursor is not None
+    page.has_previous = lambda: page.previous_cursor is not None
+    return page
+
+
+class KeysetPaginator(Paginator):
+    """Seek paginator: pages are cut by the last seen key, not by OFFSET.
+
+    Every page is a single `LIMIT per_page + 1` query over the ordering
+    index, whatever deep the page is. Pages are made by cursor_page(),
+    carrying the cursors of their neighbours as `next_cursor` and
+    `previous_cursor`. `count` and `num_pages` are still available but
+    evaluated lazily, so templates rendering keyset pages should not
+    touch them.
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, ordering=FEED_ORDERING):
+        super().__init__(object_list.order_by(*ordering), per_page)
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+
+    def _seek(self, values, backwards):
+        # (a, b) < (x, y) unrolled into a chain of OR-ed conditions
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            descending = self.ordering[i].startswith('-')
+            lookup = 'lt' if descending != backwards else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[i]})
+            for prev_field, prev_value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{prev_field: prev_value})
+            condition |= step
+        # the redundant bound on the first field lets the database
+        # seek the index instead of scanning it from the start
+        descending = self.ordering[0].startswith('-')
+        lookup = 'lte' if descending != backwards else 'gte'
+        return Q(**{f'{self.fields[0]}__{lookup}': values[0]}) & condition
+
+    def _reverse_ordering(self):
+        return [field[1:] if field.startswith('-') else '-' + field
+                for field in self.ordering]
+
+    def _field(self, name):
+        annotation = self.object_list.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return self.object_list.model._meta.get_field(name)
+
+    def to_key(self, values):
+        """The seek key of the decoded values of a cursor, None if they
+        don't fit the ordering fields: a forged cursor is not an error."""
+        key = []
+        for field, value in zip(self.fields, values):
+            if value is None:
+                return None
+            try:
+                value = self._field(field).to_python(value)
+            except (ValidationError, TypeError, ValueError, OverflowError):
+                return None
+            if isinstance(value, int) and not (
+                    KEY_INT_MIN <= value <= KEY_INT_MAX):
+                return None
+            if isinstance(value, float) and not math.isfinite(value):
+                return None
+            key.append(value)
+        return key
+
+    def key_of(self, obj):
+        values = []
+        for field in self.fields:
+            value = getattr(obj, field)
+            values.append(getattr(value, 'pk', value))
+        return values
+
+    def rows(self, values, backwards, limit):
+        """The first limit rows after the seek key values, or before it
+        when backwards, in the order they are read."""
+        queryset = self.object_list
+        if values:
+            queryset = queryset.filter(self._seek(values, backwards))
+        if backwards:
+            queryset = queryset.order_by(*self._reverse_ordering())
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        return list(queryset[:limit])
+
+    def cursor_page(self, cursor=None, backwards=False):
+        values = cursor and decode_cursor(cursor, len(self.fields))
+        values = values and self.to_key(values)
+        if not values:
+            backwards = False
+
+        rows = self.rows(values, backwards, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(values)
+
+        return cursor_page(
+            rows, self,
+            next_cursor=(encode_cursor(self.key_of(rows[-1]))
+                         if has_next and rows else None),
+            previous_cursor=(encode_cursor(self.key_of(rows[0]))
+                             if has_previous and rows else None))
+
+    @cached_property
+    def count(self):
+        return self.object_list.order_by().count()
+
+
+class CountingPaginator(Paginator):
+    """Offset paginator of the old `?page=N` links.
+
+    With count_key the count is cached under it, the callers put the
+    feed version into the key, so the count is dropped by every post
+    saved or deleted in the feed. With approximate the count is the
+    largest id of the table instead of a COUNT(*) over it: an index
+    lookup, as long as few rows were deleted.
+    """
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, count_key=None,
+                 approximate=False):
+        super().__init__(object_list, per_page)
+        self.count_key = count_key
+        self.approximate = approximate
+
+    def _count(self):
+        if self.approximate:
+            return self.object_list.model.objects.aggregate(
+                last=Max('id'))['last'] or 0
+        return Paginator.count.func(self)
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return self._count()
+        key = f'feed_count:{self.count_key}'
+        count = cache.get(key)
+        if count is None:
+            count = self._count()
+            cache.set(key, count, settings.FEED_CACHE_TIMEOUT)
+        return count
+
+    def get_elided_page_range(self, number, on_each_side=2, on_ends=1):
+        """Page numbers around number and at both ends, ELLIPSIS in
+        the gaps, instead of the whole page_range."""
+        last = self.num_pages
+        shown = set(range(1, min(on_ends, last) + 1))
+        shown.update(range(max(last - on_ends + 1, 1), last + 1))
+        shown.update(range(max(number - on_each_side, 1),
+                           min(number + on_each_side, last) + 1))
+        previous = 0
+        for page in sorted(shown):
+            if page - previous == 2:
+                # a gap of a single page is shown as the page itself
+                yield previous + 1
+            elif page - previous > 2:
+                yield self.ELLIPSIS
+            yield page
+            previous = page
+
+
+def paginate_page(request, post_list, ordering=FEED_ORDERING, feed=None,
+                  paginator_class=KeysetPaginator):
+    """Return a page of post_list for the current request.
+
+    Feeds are paginated by cursor (`?after=` / `?before=`). Old style
+    `?page=N` links are still served by the offset Paginator, so
+    bookmarks and external links keep working; the count of pages of
+    a feed named by feed, e.g. ('group', 1), is cached. The cursor
+    pages of feeds read from elsewhere are made by paginator_class.
+    """
+    page_number = request.GET.get('page')
+    if page_number is not None:
+        count_key = None
+        if feed is not None:
+            count_key = ':'.join([*map(str, feed), feed_version(*feed)])
+        paginator = CountingPaginator(
+            post_list.order_by(*ordering), settings.POSTS_PER_PAGE,
+            count_key=count_key,
+            approximate=(feed == ('index',)
+                         and settings.INDEX_APPROXIMATE_COUNT))
+        page_obj = paginator.get_page(page_number)
+        page_obj.elided_page_range = list(
+            paginator.get_elided_page_range(page_obj.number))
+        return page_obj
+
+    paginator = paginator_class(post_list, settings.POSTS_PER_PAGE, ordering)
+    before = request.GET.get('before')
+    if before:
+        return paginator.cursor_page(before, backwards=True)
+    return paginator.cursor_page(request.GET.get('after'))
 
 
-def paginate_page(request, post_list):
-    paginator = Paginator(post_list, settings.POSTS_PER_PAGE)
-    page_number = request.GET.get("page")
-    return paginator.get_page(page_number)
+def paginate_comments(request, comments):
+    """Return the page of comments selected by `?comments_after=`."""
+    paginator = KeysetPaginator(
+        comments, settings.COMMENTS_PER_PAGE, COMMENTS_ORDERING)
+    return paginator.cursor_page(request.GET.get('comments_after'))
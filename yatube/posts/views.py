@@ -1,83 +1,208 @@
-from .utils import paginate_page
+from .utils import paginate_comments, paginate_page
+from .timeline import follow_feed, follow_paginator
+from .follows import followed_authors
+from .cache import feed_context
+from .images import sources
+from .conditional import (conditional, feed_state, post_state, viewer,
+                          with_last_comment)
+from .search import SEARCH_ORDERING, search_posts
+from .api import COMMENT_FIELDS, serialize
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import render_to_string
+from django.utils.functional import SimpleLazyObject
 from .models import Post, Group, User, Follow
 from .forms import PostForm, CommentForm
-from django.urls import reverse_lazy
-from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
+from django.urls import reverse, reverse_lazy
+from django.utils.http import urlencode
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_safe
 from django.views.decorators.vary import vary_on_cookie
+from django.contrib.auth.decorators import login_required
+from core.routers import pins_primary, replica_reads
 
 
-@cache_page(20, key_prefix='index_page')
-@vary_on_cookie
+def lazy_page(request, post_list, *feed):
+    # the page is evaluated only when the cached
+    # fragment of the feed has to be rendered again
+    return SimpleLazyObject(
+        lambda: paginate_page(request, post_list, feed=feed))
+
+
+@replica_reads
 def index(request):
     template = 'posts/index.html'
 
     post_list = Post.objects.select_related("group", "author")
-    page_obj = paginate_page(request, post_list)
-    context = {'page_obj': page_obj,
+    context = {'page_obj': lazy_page(request, post_list, 'index'),
                'post_list': post_list}
+    context.update(feed_context(request, 'index'))
     return render(request, template, context)
 
 
+def group_validators(request, slug):
+    request._view_target = get_object_or_404(Group, slug=slug)
+    versions, changed = feed_state(('group', request._view_target.pk))
+    return [*versions, *viewer(request)], changed
+
+
+@replica_reads
+@cache_control(no_cache=True)
+@vary_on_cookie
+@conditional(group_validators)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
 
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts_in_group.all()
-    page_obj = paginate_page(request, post_list)
+    group = request._view_target
+    post_list = group.posts_in_group.select_related('author', 'group')
     context = {'group': group,
-               'page_obj': page_obj,
+               'page_obj': lazy_page(request, post_list, 'group', group.pk),
                }
+    context.update(feed_context(request, 'group', group.pk))
     return render(request, template, context)
 
 
+def profile_validators(request, username):
+    request._view_target = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    # the follow button changes with the profile version too
+    versions, changed = feed_state(('profile', request._view_target.pk))
+    return [*versions, *viewer(request)], changed
+
+
+@replica_reads
+@cache_control(no_cache=True)
+@vary_on_cookie
+@conditional(profile_validators)
 def profile(request, username):
     template = 'posts/profile.html'
 
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts_of_author.all()
-    page_obj = paginate_page(request, post_list)
+    author = request._view_target
+    post_list = author.posts_of_author.select_related('group')
     # is_profile used in template /includes/article.html
     # it deactivetes author name in articles
     # if they are renderd on profile page
     context = {'author': author,
-               'page_obj': page_obj,
+               'page_obj': lazy_page(request, post_list,
+                                     'profile', author.pk),
                'is_profile': True,
                }
+    context.update(feed_context(request, 'profile', author.pk))
 
-    following = request.user.is_authenticated and Follow.objects.filter(
-        user=request.user,
-        author=author
-    ).exists()
+    following = (request.user.is_authenticated
+                 and author.pk in followed_authors(request.user.pk))
     context['following'] = following
     return render(request, template, context)
 
 
+def post_validators(request, post_id):
+    request._view_target = get_object_or_404(
+        with_last_comment(
+            Post.objects.select_related('author__stats', 'group')),
+        pk=post_id)
+    parts, changed = post_state(request._view_target)
+    return [*parts, *viewer(request)], changed
+
+
+@replica_reads
+@cache_control(no_cache=True)
+@vary_on_cookie
+@conditional(post_validators)
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
     form = CommentForm()
 
-    post = get_object_or_404(Post, pk=post_id)
+    post = request._view_target
+    comments = post.comments_to_post.select_related('author')
     context = {'post': post,
+               'sources': sources([post]).get(post.pk, ()),
                'form': form,
-               'comments': post.comments_to_post.all()
+               'comments': paginate_comments(request, comments)
                }
     return render(request, template, context)
 
 
+def comments_validators(request, post_id):
+    # the fragment is the same for every user
+    request._view_target = get_object_or_404(
+        with_last_comment(Post.objects.all()), pk=post_id)
+    return post_state(request._view_target)
+
+
+@replica_reads
+@require_safe
+@cache_control(no_cache=True)
+@conditional(comments_validators)
+def comments(request, post_id):
+    """A page of comments without the rest of the post page, loaded
+    by the "next comments" link; `?format=json` wraps it in JSON."""
+    post = request._view_target
+    page = paginate_comments(
+        request, post.comments_to_post.select_related('author'))
+    html = render_to_string('includes/comments.html',
+                            {'post': post, 'comments': page}, request)
+    if request.GET.get('format') != 'json':
+        return HttpResponse(html)
+    return JsonResponse({
+        'results': [serialize(comment, COMMENT_FIELDS, COMMENT_FIELDS)
+                    for comment in page],
+        'html': html,
+        'next': page.next_cursor,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+def search_page(request):
+    query = request.GET.get('q', '').strip()
+    post_list = search_posts(query).select_related('author', 'group')
+    return query, paginate_page(request, post_list, SEARCH_ORDERING)
+
+
+def search(request):
+    template = 'posts/search.html'
+
+    query, page_obj = search_page(request)
+    context = {'query': query,
+               'page_obj': page_obj,
+               # keeps the query in the links of the paginator
+               'page_query': urlencode({'q': query}) + '&',
+               }
+    return render(request, template, context)
+
+
+def search_json(request):
+    query, page_obj = search_page(request)
+    results = [{
+        'id': post.pk,
+        'text': post.text,
+        'author': post.author.username,
+        'group': post.group and post.group.slug,
+        'pub_date': post.pub_date,
+        'score': post.score,
+        'url': reverse('posts:post_detail', args=[post.pk]),
+    } for post in page_obj]
+    return JsonResponse({
+        'query': query,
+        'results': results,
+        'next': getattr(page_obj, 'next_cursor', None),
+        'previous': getattr(page_obj, 'previous_cursor', None),
+    }, json_dumps_params={'ensure_ascii': False})
+
+
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
-        comment.post = Post.objects.get(pk=post_id)
+        comment.post = get_object_or_404(Post, pk=post_id)
         comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
+@transaction.atomic
 def post_create(request):
     template = 'posts/create_post.html'
     form = PostForm(
@@ -125,15 +250,20 @@ def post_edit(request, post_id):
     return render(request, template, context)
 
 
+@replica_reads
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginate_page(request, post_list)
+    post_list = follow_feed(request.user).select_related('group', 'author')
+    page_obj = paginate_page(
+        request, post_list,
+        paginator_class=follow_paginator(request.user))
     context = {'page_obj': page_obj, }
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@pins_primary
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author != request.user:
@@ -145,6 +275,8 @@ def profile_follow(request, username):
 
 
 @login_required
+@pins_primary
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     flw_inst = Follow.objects.filter(
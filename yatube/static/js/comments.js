@@ -0,0 +1,25 @@
+// "Следующие комментарии" loads the next page of comments in place.
+// Without the script the link opens the post page with that page.
+document.addEventListener('click', function (event) {
+  var link = event.target.closest('[data-comments-more]');
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  link.classList.add('disabled');
+  fetch(link.dataset.commentsMore, {credentials: 'same-origin'})
+    .then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.statusText);
+      }
+      return response.text();
+    })
+    .then(function (html) {
+      // the fragment ends with the link to the page after it
+      link.insertAdjacentHTML('beforebegin', html);
+      link.remove();
+    })
+    .catch(function () {
+      window.location = link.href;
+    });
+});
@@ -51,11 +51,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, to time the other middleware too
+    'core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # pins the session to the primary after writes
+    'core.routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -93,6 +97,41 @@ DATABASES = {
     }
 }
 
+# production mode of SQLite, see core/db.py: in the WAL journal
+# readers don't wait for a writer, connections outlive requests
+SQLITE_TUNING = os.environ.get('YATUBE_SQLITE_TUNING') == '1'
+# run on every new connection in the tuning mode
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    # in WAL mode the database stays consistent without a sync per commit
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    # negative is in KiB, per connection
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
+    # ms a connection waits for a lock before "database is locked"
+    'busy_timeout': 20000,
+}
+SQLITE_CONN_MAX_AGE = int(os.environ.get('YATUBE_CONN_MAX_AGE', 600))
+if SQLITE_TUNING:
+    DATABASES['default']['CONN_MAX_AGE'] = SQLITE_CONN_MAX_AGE
+
+# read-only copies of the default database for the feed pages, see
+# core/routers.py; YATUBE_DB_REPLICAS=/path/a.sqlite3,/path/b.sqlite3
+DATABASE_REPLICAS = []
+for number, name in enumerate(
+        filter(None, os.environ.get('YATUBE_DB_REPLICAS', '').split(','))):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# seconds the replicas may lag behind: a user reads from the primary
+# that long after their write, and so does a feed changed that recently
+REPLICA_LAG = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -120,11 +159,47 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
-CACHES = {
-    'default': {
+# cache backend is chosen by YATUBE_CACHE:
+# locmem - every process keeps its own cache (the default),
+# file and db - one cache shared by all the workers
+# (db needs `python manage.py createcachetable`),
+# two-tier - a small LRU in every process in front of
+# the shared cache chosen by YATUBE_SHARED_CACHE, see core/cache.py
+CACHE_BACKENDS = {
+    'locmem': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'YATUBE_CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'yatube_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
+CACHE_BACKEND = os.environ.get('YATUBE_CACHE', 'locmem')
+
+if CACHE_BACKEND == 'two-tier':
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache.TwoTierCache',
+            'LOCATION': 'two-tier',
+            'OPTIONS': {
+                'SHARED': 'shared',
+                'MAX_ENTRIES': 1000,
+                'SYNC_INTERVAL': 1,
+                'LOCAL_TIMEOUT': 60,
+            },
+        },
+        'shared': CACHE_BACKENDS[
+            os.environ.get('YATUBE_SHARED_CACHE', 'db')],
+    }
+else:
+    CACHES = {'default': CACHE_BACKENDS[CACHE_BACKEND]}
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
@@ -150,6 +225,13 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 STATIC_URL = '/static/'
 
 STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
+# collectstatic writes the files here under content-hashed names,
+# with gzip and brotli copies, served by core.staticfiles in wsgi.py
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STATICFILES_STORAGE = 'core.staticfiles.CompressedManifestStorage'
+STATIC_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+# files asked for by their plain names, e.g. by old pages
+STATIC_MAX_AGE = 60
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -162,3 +244,64 @@ LOGIN_REDIRECT_URL = 'posts:index'
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+
+# follow feed is read from precomputed per-user timelines;
+# posts of authors with more followers than the limit
+# are not copied to every timeline but merged on read,
+# until their followers fall back to the release limit
+TIMELINE_ENABLED = True
+TIMELINE_FANOUT_LIMIT = 1000
+TIMELINE_RELEASE_LIMIT = 800
+
+# rendered post cards are versioned by Post.updated,
+# so the timeout only bounds the memory held by old versions
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# thumbnails of post images are built by a pool of worker threads
+# after the post is saved, 0 builds them in the saving thread
+THUMBNAIL_WORKERS = 2
+# uploaded post images, checked before their pixels are decoded,
+# see posts/uploads.py; a file larger than FILE_UPLOAD_MAX_MEMORY_SIZE
+# is streamed to a temporary file instead of kept in memory
+IMAGE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_SIDE = 10000
+IMAGE_MAX_PIXELS = 40 * 10 ** 6
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.LimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# post images and their variants are named by the hash of their
+# content (posts/storage.py), their URLs are cached for a year
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+# the card crop of a post image is also encoded in these widths and
+# formats for srcset, see posts/images.py; a format Pillow can't
+# write is skipped, the browser takes the first one it supports
+IMAGE_VARIANT_WIDTHS = (320, 480, 640, 960, 1440)
+IMAGE_VARIANT_FORMATS = ('avif', 'webp', 'jpeg')
+IMAGE_VARIANT_QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 80}
+
+# shared parts of index, group and profile pages are cached
+# until a Post, Group or Follow change moves the feed version;
+# locmem is per process and a change moves the version in the
+# writing worker only, so there the versions and the fragments
+# expire as soon as the pages cached by cache_page used to
+if CACHE_BACKEND == 'locmem':
+    FEED_CACHE_TIMEOUT = 20
+    FEED_VERSION_TIMEOUT = 20
+else:
+    FEED_CACHE_TIMEOUT = 60 * 60
+    FEED_VERSION_TIMEOUT = None
+# page counts of the old ?page=N links of the index come from
+# the largest post id rather than COUNT(*): cheaper, but off by
+# the number of deleted posts
+INDEX_APPROXIMATE_COUNT = False
+# sets of followed authors, dropped on every Follow change
+FOLLOW_GRAPH_CACHE_TIMEOUT = 60 * 60 * 24
+
+# per-view SQL and rendering profile, see core/profiling.py;
+# shown on /_perf/ to staff and by `python manage.py perf_report`
+PERF_PROFILING = os.environ.get('YATUBE_PERF_PROFILING') == '1'
+PERF_PROFILING_DIR = os.path.join(BASE_DIR, 'perf')
+PERF_PROFILING_DUMP_INTERVAL = 10
@@ -19,6 +19,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.views import perf_report, serve_media
+
 
 handler404 = 'core.views.page_not_found'
 handler403 = 'core.views.access_error'
@@ -26,6 +28,7 @@ handler500 = 'core.views.server_error'
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('_perf/', perf_report, name='perf_report'),
     path('', include('posts.urls', namespace='posts')),
     path('group/<slug:slug>/', include('posts.urls', namespace='posts')),
     path('auth/', include('users.urls', namespace='users')),
@@ -35,5 +38,6 @@ urlpatterns = [
 
 if settings.DEBUG:
     urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
+        settings.MEDIA_URL, view=serve_media,
+        document_root=settings.MEDIA_ROOT
     )
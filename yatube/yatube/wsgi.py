@@ -11,6 +11,9 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from core.staticfiles import StaticFilesLayer
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
-application = get_wsgi_application()
+# the files of collectstatic are served before Django gets the request
+application = StaticFilesLayer(get_wsgi_application())